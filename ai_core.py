@@ -6,28 +6,88 @@ Provides a small wrapper `AnswerEngine` used by the webhook server. Keeps the
 original `Answerer` for unit tests and simple offline use.
 """
 
+from functools import lru_cache
 from pathlib import Path
+import importlib.util
 import os
 import re
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
-import yaml
+# yaml, numpy and sklearn are imported on first use so webhook processes that
+# never build a TF-IDF index (greetings, LLM-only) skip their import cost.
+# Availability is probed without importing anything.
+SKLEARN_AVAILABLE = importlib.util.find_spec("sklearn") is not None
+np = None  # bound by _import_numpy()
+openai = None  # bound by _import_openai()
 
-try:
-    import numpy as np
-    from sklearn.feature_extraction.text import TfidfVectorizer
 
-    SKLEARN_AVAILABLE = True
-except Exception:
-    # Provide a lightweight fallback when heavy ML deps are not available.
-    np = None
-    TfidfVectorizer = None
-    SKLEARN_AVAILABLE = False
 
-try:
-    import openai
-except Exception:
-    openai = None
+def _import_numpy():
+    """Import numpy on first use and bind the module-level `np`."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except Exception:
+            return None
+        np = numpy
+    return np
+
+
+def _import_openai():
+    """Import openai on first use and bind the module-level `openai`."""
+    global openai
+    if openai is None:
+        try:
+            import openai as _openai
+        except Exception:
+            return None
+        openai = _openai
+    return openai
+
+
+@lru_cache(maxsize=1)
+def _get_numba_scorer():
+    """Compile the postings scorer with numba if it is installed, else None."""
+    try:
+        from numba import njit
+    except Exception:
+        return None
+
+    # Serial on purpose: different query terms can hit the same row, so a
+    # prange over terms would race on scores[row].
+    @njit(cache=True)
+    def _score_postings(indptr, indices, data, q_cols, q_vals, n_rows):
+        scores = np.zeros(n_rows, dtype=np.float32)
+        for k in range(q_cols.shape[0]):
+            j = q_cols[k]
+            qw = q_vals[k]
+            for p in range(indptr[j], indptr[j + 1]):
+                scores[indices[p]] += qw * data[p]
+        return scores
+
+    return _score_postings
+
+
+def _get_vectorizer_cls():
+    """Return `(HashingVectorizer, TfidfTransformer)`, importing lazily."""
+    _import_numpy()
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+
+    return HashingVectorizer, TfidfTransformer
+
+
+_GREETINGS = frozenset({"hi", "hello", "hey", "good morning", "good evening"})
+
+_BLOCK_SPLIT = re.compile(r"\n\s*\n")
+_HDR = re.compile(r"^#+\s*")
+_QPREFIX = re.compile(r"^Q:\s*")
+_WORD = re.compile(r"\w+")
+
+
+def _normalize_query(text: Optional[str]) -> str:
+    """Lowercase and collapse whitespace, so trivially different repeats share a cache entry."""
+    return " ".join((text or "").lower().split())
 
 
 class Answerer:
@@ -40,19 +100,39 @@ class Answerer:
         # Expect YAML `faq.yml` by default with structure: faq: - q: ... - a: ...
         self.kb_path = Path(kb_path) if kb_path else Path(__file__).parent / "faq.yml"
         self.threshold = float(threshold)
-        self.questions: List[str] = []
-        self.answers: List[str] = []
-        self.vectorizer: Optional[TfidfVectorizer] = None
+        self.questions: Sequence[str] = []
+        self.answers: Sequence[str] = []
+        # hashing trick: no vocabulary dict to build, store or look up
+        self.hv = None
+        self.tft = None
         self.tfidf = None
+        # per-instance memo of query -> sparse TF-IDF row (skips re-tokenizing
+        # repeated questions)
+        self._vectorize_query = lru_cache(maxsize=2048)(self._transform_query)
         self._load_faq()
 
     def _load_faq(self):
-        p = Path(self.kb_path)
-        if not p.exists():
+        if not self.kb_path.exists():
             return
+        # Parsed questions and fitted indexes are shared by every Answerer
+        # over the same file version; only the query cache is per instance.
+        st = self.kb_path.stat()
+        vars(self).update(_load_cached(str(self.kb_path), st.st_mtime_ns, st.st_size))
+
+    def _build_index(self):
+        """Parse the KB file and build the TF-IDF (or fallback) index."""
+        self.questions = []
+        self.answers = []
+        self.hv = None
+        self.tft = None
+        self.tfidf = None
+        raw = self.kb_path.read_bytes().decode("utf-8")
+        if self.kb_path.suffix.lower() in (".yml", ".yaml"):
+            import yaml
 
-        if p.suffix.lower() in (".yml", ".yaml"):
-            data = yaml.safe_load(p.read_text(encoding="utf-8"))
+            # libyaml-backed loader when PyYAML was built with it
+            loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            data = yaml.load(raw, Loader=loader)
             items = data.get("faq") if isinstance(data, dict) else None
             if items:
                 for item in items:
@@ -62,30 +142,146 @@ class Answerer:
                         self.questions.append(str(q).strip())
                         self.answers.append(str(a).strip())
         else:
-            txt = p.read_text(encoding="utf-8")
-            blocks = [b.strip() for b in re.split(r"\n\s*\n", txt) if b.strip()]
+            blocks = [b.strip() for b in _BLOCK_SPLIT.split(raw) if b.strip()]
             for block in blocks:
                 lines = [ln.strip() for ln in block.splitlines() if ln.strip()]
                 if not lines:
                     continue
                 q = lines[0]
-                q = re.sub(r"^#+\s*", "", q)
-                q = re.sub(r"^Q:\s*", "", q)
+                q = _HDR.sub("", q)
+                q = _QPREFIX.sub("", q)
                 q = q.strip()
                 a = "\n".join(lines[1:]).strip() if len(lines) > 1 else ""
                 if q and a:
                     self.questions.append(q)
                     self.answers.append(a)
 
+        # freeze the store: questions are only iterated; answers become an
+        # object array (when numpy is present) so top_k can fancy-index them
+        self.questions = tuple(self.questions)
+        if _import_numpy() is not None:
+            self.answers = np.asarray(self.answers, dtype=object)
+        else:
+            self.answers = tuple(self.answers)
+
         if self.questions and SKLEARN_AVAILABLE:
             try:
-                self.vectorizer = TfidfVectorizer().fit(self.questions)
-                self.tfidf = self.vectorizer.transform(self.questions)
+                self._fit_vectorizer()
+                self._build_postings()
             except Exception:
                 # fallback to non-sklearn mode
-                self.vectorizer = None
+                self.hv = None
+                self.tft = None
                 self.tfidf = None
 
+        if self.questions and self.tft is None:
+            self._build_word_index()
+
+    def _fit_vectorizer(self):
+        """Fit TF-IDF over the questions.
+
+        The fit is shared in-process through `_load_cached`; nothing is
+        written to disk.
+        """
+        HashingVectorizer, TfidfTransformer = _get_vectorizer_cls()
+        # float32 halves the bytes scanned while scoring; ranking against a
+        # 0.2 threshold doesn't need float64 precision
+        self.hv = HashingVectorizer(
+            n_features=2**18, alternate_sign=False, norm=None, dtype=np.float32
+        )
+        counts = self.hv.transform(self.questions)
+        self.tft = TfidfTransformer().fit(counts)
+        self.tfidf = self.tft.transform(counts).tocsr()
+
+    def _build_word_index(self):
+        # Fallback index: every distinct question word gets a column. With
+        # numpy the questions become a binary (N, V) matrix so a query is
+        # scored against all of them in one matvec; without it each question
+        # is an int bitmask scored with AND + bit_count.
+        self._word_idx = {}
+        cand_cols = [
+            {
+                self._word_idx.setdefault(w, len(self._word_idx))
+                for w in _WORD.findall(cand.lower())
+            }
+            for cand in self.questions
+        ]
+        self._cand_matrix = None
+        if _import_numpy() is not None:
+            self._cand_matrix = np.zeros(
+                (len(self.questions), len(self._word_idx)), dtype=np.float32
+            )
+            for i, cols in enumerate(cand_cols):
+                self._cand_matrix[i, list(cols)] = 1.0
+            self._cand_lens = self._cand_matrix.sum(axis=1)
+        else:
+            self._cand_bits = [sum(1 << c for c in cols) for cols in cand_cols]
+            self._cand_lens = [len(cols) for cols in cand_cols]
+
+    def _build_postings(self):
+        # Inverted index over the question matrix: for term column j the
+        # postings are rows[indptr[j]:indptr[j+1]] with matching weights.
+        csc = self.tfidf.tocsc()
+        csc.sum_duplicates()
+        self._post_indptr = np.ascontiguousarray(csc.indptr)
+        self._post_rows = np.ascontiguousarray(csc.indices)
+        self._post_data = np.ascontiguousarray(csc.data, dtype=np.float32)
+
+    def _score(self, q_cols, q_vals):
+        """Cosine scores of every question against a query's (cols, weights).
+
+        Only questions sharing a term with the query can score non-zero, so
+        accumulate over the query's postings lists instead of the full matrix.
+        Rows are L2-normalised by TfidfTransformer, so the dot product is the
+        cosine similarity.
+        """
+        indptr, rows, data = self._post_indptr, self._post_rows, self._post_data
+        n_rows = self.tfidf.shape[0]
+        kernel = _get_numba_scorer()
+        if kernel is not None:
+            return kernel(indptr, rows, data, q_cols, q_vals, n_rows)
+
+        scores = np.zeros(n_rows, dtype=np.float32)
+        for j, qw in zip(q_cols.tolist(), q_vals.tolist()):
+            start, end = indptr[j], indptr[j + 1]
+            # row indices are unique within a column, so fancy += is safe
+            scores[rows[start:end]] += qw * data[start:end]
+        return scores
+
+    def _transform_query(self, q_norm: str):
+        # Cache the query in the layout the postings loop consumes: the
+        # non-zero column ids and weights of a canonical CSR row.
+        q_vec = self.tft.transform(self.hv.transform([q_norm])).tocsr()
+        q_vec.sum_duplicates()
+        cols, vals = q_vec.indices, q_vec.data
+        # Words no question uses still hash to a column and would dilute the
+        # L2 norm; drop them and renormalise, as a fitted vocabulary would.
+        indptr = self._post_indptr
+        known = indptr[cols + 1] > indptr[cols]
+        cols, vals = cols[known], vals[known]
+        norm = np.sqrt(np.dot(vals, vals))
+        if norm:
+            vals = vals / norm
+        return cols, vals.astype(np.float32, copy=False)
+
+    def top_k(self, query: str, k: int = 3) -> List[dict]:
+        """Return up to `k` TF-IDF matches, best first, as answer() dicts.
+
+        Uses argpartition so selecting the candidates is O(N); only the `k`
+        survivors are sorted. Returns [] when no TF-IDF index is loaded.
+        """
+        q = (query or "").strip()
+        if not q or k <= 0 or self.tft is None or self.tfidf is None:
+            return []
+        sims = self._score(*self._vectorize_query(q.lower()))
+        k = min(k, sims.shape[0])
+        idx = np.argpartition(-sims, k - 1)[:k]
+        idx = idx[np.argsort(-sims[idx], kind="stable")]
+        return [
+            {"answer": a, "score": float(score), "index": int(i)}
+            for a, score, i in zip(self.answers[idx], sims[idx], idx)
+        ]
+
     def answer(self, query: str) -> dict:
         """Return dict: {answer:str, score:float, index:int|None}.
 
@@ -99,7 +295,8 @@ class Answerer:
                 "index": None,
             }
 
-        if q.lower() in ("hi", "hello", "hey", "good morning", "good evening"):
+        q_lower = q.lower()
+        if q_lower in _GREETINGS:
             return {
                 "answer": "Hello — tell me what you need help with or ask a question.",
                 "score": 1.0,
@@ -114,9 +311,8 @@ class Answerer:
             }
 
         # If sklearn is available, use TF-IDF similarity
-        if SKLEARN_AVAILABLE and self.vectorizer is not None and self.tfidf is not None:
-            q_vec = self.vectorizer.transform([q])
-            sims = (self.tfidf @ q_vec.T).toarray().ravel()
+        if SKLEARN_AVAILABLE and self.tft is not None and self.tfidf is not None:
+            sims = self._score(*self._vectorize_query(q_lower))
             best_idx = int(np.argmax(sims))
             best_score = float(sims[best_idx])
 
@@ -137,18 +333,35 @@ class Answerer:
             }
 
         # Fallback simple matcher: word-overlap heuristic (fast, no external deps)
-        q_words = set(re.findall(r"\w+", q.lower()))
+        q_cols = {
+            self._word_idx[w]
+            for w in _WORD.findall(q_lower)
+            if w in self._word_idx
+        }
         best_idx = None
         best_score = 0.0
-        for i, cand in enumerate(self.questions):
-            cand_words = set(re.findall(r"\w+", cand.lower()))
-            if not cand_words:
-                continue
-            overlap = q_words & cand_words
-            score = len(overlap) / max(1, len(cand_words))
-            if score > best_score:
-                best_score = score
-                best_idx = i
+        if self._cand_matrix is not None:
+            q_vec = np.zeros(len(self._word_idx), dtype=np.float32)
+            q_vec[list(q_cols)] = 1.0
+            overlap = self._cand_matrix @ q_vec
+            scores = np.divide(
+                overlap,
+                self._cand_lens,
+                out=np.zeros_like(overlap),
+                where=self._cand_lens > 0,
+            )
+            i = int(np.argmax(scores))
+            if scores[i] > 0:
+                best_idx, best_score = i, float(scores[i])
+        else:
+            q_bits = sum(1 << c for c in q_cols)
+            for i, (cand_bits, n_words) in enumerate(zip(self._cand_bits, self._cand_lens)):
+                if not n_words:
+                    continue
+                score = (q_bits & cand_bits).bit_count() / n_words
+                if score > best_score:
+                    best_score = score
+                    best_idx = i
 
         if best_score < self.threshold or best_idx is None:
             return {
@@ -167,6 +380,32 @@ class Answerer:
         }
 
 
+@lru_cache(maxsize=512)
+def _cached_completion(prompt: str, model: str) -> str:
+    # failures raise and are therefore not cached
+    resp = openai.ChatCompletion.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=256,
+        temperature=0.2,
+    )
+    return resp.choices[0].message.content.strip()
+
+
+@lru_cache(maxsize=8)
+def _load_cached(path_str: str, mtime_ns: int, size: int) -> dict:
+    """Build the index state for one version of a KB file.
+
+    Keyed by mtime and size so an edited FAQ is picked up on the next
+    Answerer construction; the returned attributes must be treated as
+    read-only since every Answerer over that file shares them.
+    """
+    index = Answerer.__new__(Answerer)
+    index.kb_path = Path(path_str)
+    index._build_index()
+    return dict(vars(index))
+
+
 class AnswerEngine:
     """Higher-level engine used by the webhook server.
 
@@ -176,11 +415,22 @@ class AnswerEngine:
     """
 
     def __init__(
-        self, redis_client=None, kb_path: Optional[str] = None, use_llm: bool = False
+        self,
+        redis_client=None,
+        kb_path: Optional[str] = None,
+        use_llm: bool = False,
+        llm_floor: float = 0.05,
     ):
         self.redis = redis_client
+        # below this TF-IDF score the query is treated as noise and never
+        # sent to the LLM; with no FAQ loaded there is no score to judge by
+        self.llm_floor = float(llm_floor)
+        self.kb_path = kb_path
         self.answerer = Answerer(kb_path=kb_path)
-        self.use_llm = use_llm and (openai is not None)
+        # normalized text -> Answerer result; the memory-dependent LLM
+        # fallback stays outside the cache
+        self._reply_cache = lru_cache(maxsize=1024)(self._answer_core)
+        self.use_llm = use_llm and _import_openai() is not None
 
         # configure openai if api key present
         if self.use_llm:
@@ -194,30 +444,37 @@ class AnswerEngine:
         if openai is None:
             return ""
         try:
-            resp = openai.ChatCompletion.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo"),
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=256,
-                temperature=0.2,
+            return _cached_completion(
+                prompt, os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
             )
-            return resp.choices[0].message.content.strip()
         except Exception:
             return ""
 
+    def reload(self) -> None:
+        """Re-read the FAQ and drop cached replies."""
+        _load_cached.cache_clear()
+        self.answerer = Answerer(kb_path=self.kb_path)
+        self._reply_cache.cache_clear()
+
+    def _answer_core(self, q_norm: str) -> dict:
+        return self.answerer.answer(q_norm)
+
     def answer(self, user_text: str, memory: Optional[List[dict]] = None) -> str:
-        # memory: list of {role, text, ts}
-        mem_text = "\n".join(
-            [
-                f"{m.get('role')}: {m.get('text')}" if isinstance(m, dict) else str(m)
-                for m in (memory or [])
-            ]
-        )
-        qa = self.answerer.answer(user_text)
+        qa = self._reply_cache(_normalize_query(user_text))
         if qa.get("score", 0.0) >= self.answerer.threshold:
             return qa.get("answer")
 
-        # low confidence — use LLM if enabled
-        if self.use_llm:
+        # low confidence — use LLM if enabled and the query isn't garbage
+        if self.use_llm and (
+            not self.answerer.questions or qa.get("score", 0.0) >= self.llm_floor
+        ):
+            # memory: list of {role, text, ts}
+            mem_text = "\n".join(
+                [
+                    f"{m.get('role')}: {m.get('text')}" if isinstance(m, dict) else str(m)
+                    for m in (memory or [])
+                ]
+            )
             prompt = (
                 f"User: {user_text}\nContext:\n{mem_text}\n"
                 "Provide a helpful, concise answer."
@@ -1,21 +1,26 @@
 import os
-import json
-from datetime import datetime
+import time
+from urllib.parse import parse_qs
 from flask import Flask, request, jsonify, abort
-import requests
+from flask.json.provider import DefaultJSONProvider
 import logging
 from logging.config import dictConfig
 try:
     from .ai_core import AnswerEngine
 except ImportError:
     from ai_core import AnswerEngine
+import msgpack
+import orjson
 from redis import Redis
 from twilio.request_validator import RequestValidator
-from twilio.rest import Client as TwilioClient
 try:
     from .zac_bot import ensure_db, handle_command, handle_text, has_active_session
+    from .message_queue import enqueue_message, start_workers
+    from .routing import normalize_wa
 except ImportError:
     from zac_bot import ensure_db, handle_command, handle_text, has_active_session
+    from message_queue import enqueue_message, start_workers
+    from routing import normalize_wa
 
 # -------------------------
 # Basic logging configuration
@@ -47,21 +52,36 @@ TWILIO_WHATSAPP_FROM = os.environ.get("TWILIO_WHATSAPP_FROM") or os.environ.get(
 )
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 
-twilio_client = None
+# built once; validating a webhook only needs the token
+twilio_validator = None
 if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-    twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    twilio_validator = RequestValidator(TWILIO_AUTH_TOKEN)
 
 try:
-    redis_client = Redis.from_url(REDIS_URL, decode_responses=True)
+    redis_client = Redis.from_url(REDIS_URL, decode_responses=False)
     redis_client.ping()
     logger.info("Connected to Redis.")
 except Exception as e:
     redis_client = None
     logger.warning(f"Redis not available: {e}")
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (request bodies and jsonify)."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 answer_engine = AnswerEngine(redis_client=redis_client)  # uses ai_core.py
 ensure_db()
+# outbound Telegram/Twilio sends run on background workers, off the request path
+start_workers()
 
 # -------------------------
 # Helpers: conversation memory
@@ -77,19 +97,49 @@ def push_memory(channel, chat_id, role, text):
     if not redis_client:
         return
     key = mem_key(channel, chat_id)
-    entry = json.dumps(
-        {"role": role, "text": text, "ts": datetime.utcnow().isoformat()}
-    )
-    redis_client.rpush(key, entry)
-    redis_client.ltrim(key, -MAX_MEMORY_TURNS * 2, -1)
+    entry = msgpack.packb({"role": role, "text": text, "ts": time.time()})
+    # one round-trip for append + trim
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.rpush(key, entry)
+    pipe.ltrim(key, -MAX_MEMORY_TURNS * 2, -1)
+    pipe.execute()
+
+
+def _unpack_memory(items):
+    # raw bytes from Redis; entries that don't decode (e.g. the old JSON
+    # format) are dropped and age out via ltrim
+    entries = []
+    for item in items:
+        try:
+            entries.append(msgpack.unpackb(item))
+        except (ValueError, msgpack.UnpackException):
+            continue
+    return entries
 
 
 def get_memory(channel, chat_id):
     if not redis_client:
         return []
     key = mem_key(channel, chat_id)
-    items = redis_client.lrange(key, 0, -1)
-    return [json.loads(i) for i in items]
+    return _unpack_memory(redis_client.lrange(key, 0, -1))
+
+
+def get_memory_many(channel, chat_ids):
+    """Fetch memory for several chats in one pipelined round-trip.
+
+    Returns {chat_id: [entries]} in the same shape as `get_memory`.
+    """
+    chat_ids = list(chat_ids)
+    if not redis_client:
+        return {chat_id: [] for chat_id in chat_ids}
+    pipe = redis_client.pipeline(transaction=False)
+    for chat_id in chat_ids:
+        pipe.lrange(mem_key(channel, chat_id), 0, -1)
+    results = pipe.execute()
+    return {
+        chat_id: _unpack_memory(items)
+        for chat_id, items in zip(chat_ids, results)
+    }
 
 
 # -------------------------
@@ -97,9 +147,14 @@ def get_memory(channel, chat_id):
 # -------------------------
 @app.route("/webhook/telegram", methods=["POST"])
 def telegram_webhook():
-    payload = request.get_json(force=True)
-    logger.debug(f"Telegram payload: {payload}")
-    if "message" not in payload:
+    # parse the raw body directly; Telegram always posts JSON
+    try:
+        payload = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        logger.debug("Unparseable Telegram payload.")
+        return ("", 204)
+    logger.debug("Telegram payload: %s", payload)
+    if not isinstance(payload, dict) or "message" not in payload:
         logger.debug("No message in payload.")
         return ("", 204)
 
@@ -121,49 +176,44 @@ def telegram_webhook():
             push_memory("telegram", chat_id, "user", text)
             push_memory("telegram", chat_id, "assistant", reply_text)
 
-    send_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    try:
-        resp = requests.post(send_url, json={"chat_id": chat_id, "text": reply_text})
-        logger.debug(f"Telegram sendMessage status: {resp.status_code}")
-    except Exception:
-        logger.exception("Failed to send message to Telegram.")
+    enqueue_message({"platform": "telegram", "to": chat_id, "body": reply_text})
     return ("", 200)
 
 
 # -------------------------
 # Twilio (WhatsApp) webhook with validation
 # -------------------------
+class _FormParams(dict):
+    """parse_qs() output; getlist() is what RequestValidator looks for."""
+
+    getlist = dict.__getitem__
+
+    def first(self, name):
+        values = self.get(name)
+        return values[0] if values else None
+
+
 @app.route("/webhook/whatsapp", methods=["POST"])
 def whatsapp_webhook():
+    # Twilio posts a flat urlencoded form; parse_qs is cheaper than
+    # building Werkzeug's form MultiDict for the two fields we read
+    form = _FormParams(parse_qs(request.get_data(cache=False, as_text=True), keep_blank_values=True))
+
     # validate request signature if credentials present
-    if TWILIO_AUTH_TOKEN and TWILIO_ACCOUNT_SID:
-        validator = RequestValidator(TWILIO_AUTH_TOKEN)
+    if twilio_validator is not None:
         signature = request.headers.get("X-Twilio-Signature", "")
-        url = request.url
-        post_vars = request.form.to_dict()
-        if not validator.validate(url, post_vars, signature):
+        if not twilio_validator.validate(request.url, form, signature):
             logger.warning("Twilio signature validation failed.")
             return abort(403)
 
-    from_number = request.form.get("From")
-    body = request.form.get("Body", "").strip()
+    from_number = form.first("From")
+    body = (form.first("Body") or "").strip()
     chat_id = from_number
 
     if not body:
         reply_text = "Only text messages are supported on WhatsApp."
     else:
-        normalized = body
-        lowered = body.lower()
-        if not body.startswith("/"):
-            if lowered in ("register", "onboard", "profile", "balance", "loans"):
-                normalized = f"/{lowered}"
-            elif lowered in ("apply loan", "loan"):
-                normalized = "/apply_loan"
-            elif lowered == "send otp":
-                normalized = "/send_otp"
-            elif lowered.startswith("verify otp"):
-                code = lowered.replace("verify otp", "").strip()
-                normalized = f"/verify_otp {code}" if code else "/verify_otp"
+        normalized = normalize_wa(body)
 
         cmd_resp = handle_command(str(chat_id), normalized)
         if cmd_resp is not None:
@@ -176,16 +226,14 @@ def whatsapp_webhook():
             push_memory("whatsapp", chat_id, "user", body)
             push_memory("whatsapp", chat_id, "assistant", reply_text)
 
-    if twilio_client:
-        try:
-            twilio_client.messages.create(
-                body=reply_text, from_=TWILIO_WHATSAPP_FROM, to=from_number
-            )
-        except Exception:
-            logger.exception("Failed to send Twilio WhatsApp message.")
-            return ("", 500)
-    else:
-        logger.info("Twilio client not configured; skipping send.")
+    enqueue_message(
+        {
+            "platform": "whatsapp",
+            "to": from_number,
+            "body": reply_text,
+            "from": TWILIO_WHATSAPP_FROM,
+        }
+    )
     return ("", 204)
 
 
@@ -197,5 +245,6 @@ def health():
     return jsonify({"status": "ok"}), 200
 
 
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
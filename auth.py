@@ -1,24 +1,102 @@
-"""PIN hashing and verification utilities (using PBKDF2)."""
+"""PIN hashing and verification utilities (Argon2id, with PBKDF2 fallback)."""
+import asyncio
 import os
 import hashlib
+import hmac
 import binascii
-from typing import Tuple
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
 
-# PBKDF2 params
-_ITER = 100_000
-_HASH_NAME = "sha256"
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+
+    # OWASP minimum for Argon2id: 19 MiB, 2 passes
+    _ARGON2 = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=2)
+except Exception:
+    _ARGON2 = None
+
+# PBKDF2 params, used when argon2-cffi is not installed. 35k SHA-512 rounds
+# cost an attacker about as much as the 100k SHA-256 rounds used before
+# (OWASP's 210k/600k ratio) while being cheaper for us to verify.
+_ITER = 35_000
+_HASH_NAME = "sha512"
 _SALT_BYTES = 16
 
+# Hashes stored without a "<hash>$<iterations>$" prefix predate SHA-512.
+_LEGACY_ITER = 100_000
+_LEGACY_HASH_NAME = "sha256"
+
+# KDF work for async callers runs in a process pool, created on first use.
+# "spawn" because callers are threaded servers, where fork is unsafe.
+_kdf_pool: Optional[ProcessPoolExecutor] = None
+_kdf_pool_lock = threading.Lock()
+
+
+def _get_kdf_pool() -> ProcessPoolExecutor:
+    global _kdf_pool
+    with _kdf_pool_lock:
+        if _kdf_pool is None:
+            _kdf_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _kdf_pool
+
+
+def _reset_after_fork():
+    # the parent's pool (and its management thread) is not usable here
+    global _kdf_pool, _kdf_pool_lock
+    _kdf_pool = None
+    _kdf_pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
 
 def make_pin_hash(pin: str) -> Tuple[str, str]:
-    """Return (salt_hex, hash_hex)"""
+    """Return (salt_hex, hash).
+
+    With argon2-cffi the hash is the self-describing "$argon2id$..." string
+    (salt included, so salt_hex is empty); otherwise it is
+    "sha512$<iterations>$<hex>" with a separate salt.
+    """
+    if _ARGON2 is not None:
+        return "", _ARGON2.hash(pin)
     salt = os.urandom(_SALT_BYTES)
     dk = hashlib.pbkdf2_hmac(_HASH_NAME, pin.encode("utf-8"), salt, _ITER)
-    return binascii.hexlify(salt).decode("ascii"), binascii.hexlify(dk).decode("ascii")
+    hash_str = f"{_HASH_NAME}${_ITER}${binascii.hexlify(dk).decode('ascii')}"
+    return binascii.hexlify(salt).decode("ascii"), hash_str
 
 
 def verify_pin(pin: str, salt_hex: str, hash_hex: str) -> bool:
+    if hash_hex.startswith("$argon2"):
+        if _ARGON2 is None:
+            return False
+        try:
+            return _ARGON2.verify(hash_hex, pin)
+        except (VerificationError, InvalidHashError):
+            return False
+    if "$" in hash_hex:
+        hash_name, iterations, hash_hex = hash_hex.split("$", 2)
+        iterations = int(iterations)
+    else:
+        hash_name, iterations = _LEGACY_HASH_NAME, _LEGACY_ITER
     salt = binascii.unhexlify(salt_hex.encode("ascii"))
     expected = binascii.unhexlify(hash_hex.encode("ascii"))
-    dk = hashlib.pbkdf2_hmac(_HASH_NAME, pin.encode("utf-8"), salt, _ITER)
-    return hashlib.compare_digest(dk, expected)
+    dk = hashlib.pbkdf2_hmac(hash_name, pin.encode("utf-8"), salt, iterations)
+    return hmac.compare_digest(dk, expected)
+
+
+async def make_pin_hash_async(pin: str) -> Tuple[str, str]:
+    """`make_pin_hash` on the KDF process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_kdf_pool(), make_pin_hash, pin)
+
+
+async def verify_pin_async(pin: str, salt_hex: str, hash_hex: str) -> bool:
+    """`verify_pin` on the KDF process pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_kdf_pool(), verify_pin, pin, salt_hex, hash_hex)
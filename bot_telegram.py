@@ -87,7 +87,6 @@ def main():
 
     def register_cmd(update, context):
         chat_id = update.message.chat_id
-        ensure_db()
         update.message.reply_text(start_register(str(chat_id)))
 
     def balance_cmd(update, context):
@@ -7,7 +7,7 @@ It uses ai_core.Answerer to generate replies.
 Usage:
  - Copy `.env.example` to `.env` and fill TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER
  - Expose this app to the internet (ngrok or a VPS) and set the Twilio Messaging webhook to the /whatsapp route.
- - python bot_whatsapp.py
+ - python bot_whatsapp.py (local development; Gunicorn serves production)
 """
 
 import os
@@ -24,8 +24,10 @@ except ImportError:
 from logging_config import configure_logging
 try:
     from .message_queue import enqueue_message, start_workers
+    from .routing import normalize_wa
 except ImportError:
     from message_queue import enqueue_message, start_workers
+    from routing import normalize_wa
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -55,18 +57,7 @@ def whatsapp_webhook():
         resp.message("I didn't receive your message. Please send a question.")
         return Response(str(resp), mimetype="application/xml")
 
-    normalized = body
-    lowered = body.lower()
-    if not body.startswith("/"):
-        if lowered in ("register", "onboard", "profile", "balance", "loans"):
-            normalized = f"/{lowered}"
-        elif lowered in ("apply loan", "loan"):
-            normalized = "/apply_loan"
-        elif lowered == "send otp":
-            normalized = "/send_otp"
-        elif lowered.startswith("verify otp"):
-            code = lowered.replace("verify otp", "").strip()
-            normalized = f"/verify_otp {code}" if code else "/verify_otp"
+    normalized = normalize_wa(body)
 
     cmd_resp = handle_command(from_number, normalized)
     if cmd_resp is not None:
@@ -92,7 +83,9 @@ def whatsapp_webhook():
     return Response(str(resp), mimetype="application/xml")
 
 
+
 if __name__ == "__main__":
+    # local development server; production runs under Gunicorn (see Dockerfile)
     host = os.getenv("SERVER_HOST", "0.0.0.0")
     port = int(os.getenv("SERVER_PORT", 5000))
     logger.info("Starting Flask app on %s:%s", host, port)
@@ -1,21 +1,145 @@
 """Lightweight SQLite DB helper for zac_sacco_credit_bot features."""
 import os
 import sqlite3
-from datetime import datetime
-from typing import Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
 
 DB_PATH = os.environ.get("ZAC_DB_PATH", os.path.join(os.path.dirname(__file__), "zac.db"))
 
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA cache_size=-64000",  # 64 MB page cache per connection
+)
 
-def _conn():
+# one long-lived connection per thread instead of a connect() per call
+_local = threading.local()
+
+
+def _reset_after_fork():
+    # a connection inherited from a preloading parent must not be reused
+    global _local
+    _local = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Statement text lives in module constants so every call hands sqlite3 the
+# identical string and hits the connection's prepared-statement cache.
+_Q_INSERT_USER = "INSERT OR IGNORE INTO users (chat_id, phone, pin_salt, pin_hash, created_at) VALUES (?, ?, ?, ?, ?)"
+_Q_USER_ID = "SELECT id FROM users WHERE chat_id = ?"
+_Q_INSERT_ACCOUNT = "INSERT OR IGNORE INTO accounts (user_id, balance) VALUES (?, ?)"
+_Q_UPDATE_PHONE = "UPDATE users SET phone = ? WHERE id = ? RETURNING chat_id"
+_Q_GET_USER = "SELECT id, chat_id, phone, pin_salt, pin_hash, created_at FROM users WHERE chat_id = ?"
+_Q_GET_BALANCE = "SELECT a.balance FROM users u LEFT JOIN accounts a ON a.user_id = u.id WHERE u.chat_id = ?"
+_Q_INSERT_LOAN = (
+    "INSERT INTO loans (user_id, amount, reason, status, created_at) SELECT id, ?, ?, ?, ? FROM users WHERE chat_id = ?"
+    " RETURNING id"
+)
+# one display line per loan, built by sqlite rather than per row in Python
+_Q_LIST_LOANS_FORMATTED = (
+    "SELECT printf('#%d: KES %s - %s (%s)', l.id, l.amount, l.status,"
+    " strftime('%Y-%m-%d %H:%M', CAST(l.created_at AS INTEGER), 'unixepoch'))"
+    " FROM loans l JOIN users u ON l.user_id = u.id WHERE u.chat_id = ? ORDER BY l.id DESC"
+)
+# same insert, also handing back the borrower's income for the limit hint
+_Q_SUBMIT_LOAN = (
+    "INSERT INTO loans (user_id, amount, reason, status, created_at) SELECT id, ?, ?, ?, ? FROM users WHERE chat_id = ?"
+    " RETURNING id, (SELECT monthly_income FROM profiles p WHERE p.user_id = loans.user_id)"
+)
+_Q_LIST_LOANS = (
+    "SELECT l.id, l.amount, l.reason, l.status, CAST(l.created_at AS INTEGER) FROM loans l JOIN users u ON l.user_id = u.id"
+    " WHERE u.chat_id = ? ORDER BY l.id DESC"
+)
+_Q_INSERT_OTP = (
+    "INSERT INTO otps (user_id, code_hash, expires_at, consumed, created_at)"
+    " SELECT id, ?, ?, 0, ? FROM users WHERE chat_id = ? RETURNING id"
+)
+# executemany can't run a statement that returns rows
+_Q_INSERT_OTP_MANY = (
+    "INSERT INTO otps (user_id, code_hash, expires_at, consumed, created_at)"
+    " SELECT id, ?, ?, 0, ? FROM users WHERE chat_id = ?"
+)
+# finds the newest live matching code and burns it in one statement
+_Q_CONSUME_OTP = (
+    "UPDATE otps SET consumed = 1 WHERE id = ("
+    "SELECT o.id FROM otps o JOIN users u ON o.user_id = u.id"
+    " WHERE u.chat_id = ? AND o.code_hash = ? AND o.consumed = 0 AND CAST(o.expires_at AS INTEGER) > ?"
+    " ORDER BY o.id DESC LIMIT 1) RETURNING id"
+)
+_Q_UPSERT_PROFILE = (
+    "INSERT INTO profiles (user_id, full_name, national_id, employer, monthly_income, consent, created_at, updated_at)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT(user_id) DO UPDATE SET full_name = excluded.full_name, national_id = excluded.national_id,"
+    " employer = excluded.employer, monthly_income = excluded.monthly_income, consent = excluded.consent,"
+    " updated_at = excluded.updated_at"
+)
+_Q_GET_PROFILE = (
+    "SELECT user_id, full_name, national_id, employer, monthly_income, consent, created_at, updated_at"
+    " FROM profiles WHERE user_id = ?"
+)
+_Q_GET_USER_WITH_PROFILE = (
+    "SELECT u.id, u.chat_id, u.phone, p.full_name, p.national_id, p.employer, p.monthly_income, p.consent"
+    " FROM users u LEFT JOIN profiles p ON p.user_id = u.id WHERE u.chat_id = ?"
+)
+
+
+def _conn() -> sqlite3.Connection:
+    """Return this thread's connection to DB_PATH, opening it on first use.
+
+    Connections run in autocommit mode; writes go through ``_write()``.
+    """
+    c = getattr(_local, "conn", None)
+    if c is not None and _local.path == DB_PATH:
+        return c
+    if c is not None:
+        c.close()
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    return sqlite3.connect(DB_PATH)
+    # timeout= is sqlite's busy_timeout: wait up to 30s on a locked database
+    c = sqlite3.connect(
+        DB_PATH, timeout=30, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
+    for pragma in _PRAGMAS:
+        c.execute(pragma)
+    _local.conn, _local.path = c, DB_PATH
+    return c
+
+
+@contextmanager
+def _write():
+    """Run the block in a ``BEGIN IMMEDIATE`` transaction on this thread's connection."""
+    c = _conn()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        yield c.cursor()
+        # inside the try: a failed COMMIT must not leave the connection
+        # stuck in an open transaction
+        c.execute("COMMIT")
+    except BaseException:
+        # some COMMIT failures (FULL, IOERR) already rolled back
+        if c.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+
+
+_TIMESTAMP_COLUMNS = (
+    ("users", "created_at"),
+    ("loans", "created_at"),
+    ("otps", "expires_at"),
+    ("otps", "created_at"),
+    ("profiles", "created_at"),
+    ("profiles", "updated_at"),
+)
 
 
 def init_db() -> None:
     """Create tables if they don't exist."""
-    with _conn() as c:
-        cur = c.cursor()
+    with _write() as cur:
         cur.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -24,7 +148,7 @@ def init_db() -> None:
                 phone TEXT,
                 pin_salt TEXT,
                 pin_hash TEXT,
-                created_at TEXT
+                created_at INTEGER
             )
             """
         )
@@ -46,7 +170,7 @@ def init_db() -> None:
                 amount REAL,
                 reason TEXT,
                 status TEXT,
-                created_at TEXT,
+                created_at INTEGER,
                 FOREIGN KEY(user_id) REFERENCES users(id)
             )
             """
@@ -58,9 +182,9 @@ def init_db() -> None:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 code_hash TEXT,
-                expires_at TEXT,
+                expires_at INTEGER,
                 consumed INTEGER DEFAULT 0,
-                created_at TEXT,
+                created_at INTEGER,
                 FOREIGN KEY(user_id) REFERENCES users(id)
             )
             """
@@ -75,129 +199,124 @@ def init_db() -> None:
                 employer TEXT,
                 monthly_income REAL,
                 consent INTEGER DEFAULT 0,
-                created_at TEXT,
-                updated_at TEXT,
+                created_at INTEGER,
+                updated_at INTEGER,
                 FOREIGN KEY(user_id) REFERENCES users(id)
             )
             """
         )
-        c.commit()
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_loans_user ON loans(user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_otps_user_code ON otps(user_id, code_hash)")
+        # timestamps used to be ISO-8601 text; convert rows from older databases
+        # (whose TEXT-declared columns keep epochs as digit strings)
+        for table, column in _TIMESTAMP_COLUMNS:
+            cur.execute(
+                f"UPDATE {table} SET {column} = CAST(strftime('%s', {column}) AS INTEGER)"
+                f" WHERE {column} LIKE '____-__-__%'"
+            )
 
 
 # User functions
 
 def create_user(chat_id: str, phone: Optional[str], pin_salt: str, pin_hash: str) -> int:
-    now = datetime.utcnow().isoformat()
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute(
-            "INSERT OR IGNORE INTO users (chat_id, phone, pin_salt, pin_hash, created_at) VALUES (?, ?, ?, ?, ?)",
-            (chat_id, phone, pin_salt, pin_hash, now),
-        )
-        c.commit()
-        cur.execute("SELECT id FROM users WHERE chat_id = ?", (chat_id,))
+    now = int(time.time())
+    with _write() as cur:
+        cur.execute(_Q_INSERT_USER, (chat_id, phone, pin_salt, pin_hash, now))
+        cur.execute(_Q_USER_ID, (chat_id,))
         row = cur.fetchone()
         user_id = row[0]
         # ensure account exists
-        cur.execute("INSERT OR IGNORE INTO accounts (user_id, balance) VALUES (?, ?)", (user_id, 0.0))
-        c.commit()
-        return user_id
+        cur.execute(_Q_INSERT_ACCOUNT, (user_id, 0.0))
+    return user_id
+
+
+def update_user_phone(user_id: int, phone: str) -> bool:
+    """Set the phone on an existing user; False if there is no such user."""
+    with _write() as cur:
+        row = cur.execute(_Q_UPDATE_PHONE, (phone, user_id)).fetchone()
+    return row is not None
 
 
 def get_user_by_chat(chat_id: str) -> Optional[dict]:
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute("SELECT id, chat_id, phone, pin_salt, pin_hash, created_at FROM users WHERE chat_id = ?", (chat_id,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "id": row[0],
-            "chat_id": row[1],
-            "phone": row[2],
-            "pin_salt": row[3],
-            "pin_hash": row[4],
-            "created_at": row[5],
-        }
+    """Return the user row, or None.
+
+    Deliberately uncached: phone and pin_hash change through other Gunicorn
+    workers, and an in-process copy would go stale there.
+    """
+    row = _conn().execute(_Q_GET_USER, (chat_id,)).fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "chat_id": row[1],
+        "phone": row[2],
+        "pin_salt": row[3],
+        "pin_hash": row[4],
+        "created_at": row[5],
+    }
 
 
 # Account functions
 
 def get_balance(chat_id: str) -> Optional[float]:
-    user = get_user_by_chat(chat_id)
-    if not user:
+    row = _conn().execute(_Q_GET_BALANCE, (chat_id,)).fetchone()
+    if not row:
         return None
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute("SELECT balance FROM accounts WHERE user_id = ?", (user["id"],))
-        row = cur.fetchone()
-        return float(row[0]) if row else 0.0
+    return float(row[0]) if row[0] is not None else 0.0
 
 
 # Loan functions
 
 def create_loan(chat_id: str, amount: float, reason: str) -> Optional[int]:
-    user = get_user_by_chat(chat_id)
-    if not user:
-        return None
-    now = datetime.utcnow().isoformat()
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute(
-            "INSERT INTO loans (user_id, amount, reason, status, created_at) VALUES (?, ?, ?, ?, ?)",
-            (user["id"], float(amount), reason, "pending", now),
-        )
-        c.commit()
-        return cur.lastrowid
+    now = int(time.time())
+    with _write() as cur:
+        row = cur.execute(_Q_INSERT_LOAN, (float(amount), reason, "pending", now, chat_id)).fetchone()
+    # no row back means no such user
+    return row[0] if row else None
+
+
+def submit_loan(chat_id: str, amount: float, reason: str) -> Tuple[Optional[int], Optional[float]]:
+    """Like `create_loan`, returning (loan_id, monthly_income) from the same statement.
+
+    Both are None for an unknown chat_id; income is None without a profile.
+    """
+    now = int(time.time())
+    with _write() as cur:
+        row = cur.execute(_Q_SUBMIT_LOAN, (float(amount), reason, "pending", now, chat_id)).fetchone()
+    return (row[0], row[1]) if row else (None, None)
 
 
 def list_loans(chat_id: str) -> list:
-    user = get_user_by_chat(chat_id)
-    if not user:
-        return []
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute("SELECT id, amount, reason, status, created_at FROM loans WHERE user_id = ? ORDER BY id DESC", (user["id"],))
-        rows = cur.fetchall()
-        return [dict(id=r[0], amount=r[1], reason=r[2], status=r[3], created_at=r[4]) for r in rows]
+    rows = _conn().execute(_Q_LIST_LOANS, (chat_id,)).fetchall()
+    return [dict(id=r[0], amount=r[1], reason=r[2], status=r[3], created_at=r[4]) for r in rows]
+
+
+def list_loans_formatted(chat_id: str) -> list:
+    """Return the user's loans as ready-to-send lines, newest first."""
+    return [r[0] for r in _conn().execute(_Q_LIST_LOANS_FORMATTED, (chat_id,))]
 
 # OTP functions
 
-def create_otp_for_user(chat_id: str, code_hash: str, expires_at: str) -> Optional[int]:
-    user = get_user_by_chat(chat_id)
-    if not user:
-        return None
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute(
-            "INSERT INTO otps (user_id, code_hash, expires_at, consumed, created_at) VALUES (?, ?, ?, 0, ?)",
-            (user["id"], code_hash, expires_at, datetime.utcnow().isoformat()),
-        )
-        c.commit()
-        return cur.lastrowid
+def create_otp_for_user(chat_id: str, code_hash: str, expires_at: int) -> Optional[int]:
+    with _write() as cur:
+        row = cur.execute(_Q_INSERT_OTP, (code_hash, expires_at, int(time.time()), chat_id)).fetchone()
+    return row[0] if row else None
+
+
+def create_otps_bulk(otps: Iterable[Tuple[str, str, int]]) -> int:
+    """Store many (chat_id, code_hash, expires_at) OTPs in one transaction.
+
+    Unknown chat_ids are skipped; returns the number of rows inserted.
+    """
+    now = int(time.time())
+    with _write() as cur:
+        cur.executemany(_Q_INSERT_OTP_MANY, ((h, exp, now, chat_id) for chat_id, h, exp in otps))
+        return cur.rowcount
 
 
 def consume_otp(chat_id: str, code_hash: str) -> bool:
-    user = get_user_by_chat(chat_id)
-    if not user:
-        return False
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute(
-            "SELECT id, expires_at, consumed FROM otps WHERE user_id = ? AND code_hash = ? ORDER BY id DESC LIMIT 1",
-            (user["id"], code_hash),
-        )
-        row = cur.fetchone()
-        if not row:
-            return False
-        id_, expires_at, consumed = row
-        if consumed:
-            return False
-        if datetime.fromisoformat(expires_at) < datetime.utcnow():
-            return False
-        cur.execute("UPDATE otps SET consumed = 1 WHERE id = ?", (id_,))
-        c.commit()
-        return True
+    rows = _conn().execute(_Q_CONSUME_OTP, (chat_id, code_hash, int(time.time()))).fetchall()
+    return bool(rows)
 
 
 # Profile functions
@@ -210,43 +329,45 @@ def upsert_profile(
     monthly_income: float,
     consent: int,
 ) -> None:
-    now = datetime.utcnow().isoformat()
-    with _conn() as c:
-        cur = c.cursor()
+    now = int(time.time())
+    with _write() as cur:
         cur.execute(
-            """
-            INSERT INTO profiles (user_id, full_name, national_id, employer, monthly_income, consent, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                full_name = excluded.full_name,
-                national_id = excluded.national_id,
-                employer = excluded.employer,
-                monthly_income = excluded.monthly_income,
-                consent = excluded.consent,
-                updated_at = excluded.updated_at
-            """,
+            _Q_UPSERT_PROFILE,
             (user_id, full_name, national_id, employer, float(monthly_income), int(consent), now, now),
         )
-        c.commit()
 
 
 def get_profile(user_id: int) -> Optional[dict]:
-    with _conn() as c:
-        cur = c.cursor()
-        cur.execute(
-            "SELECT user_id, full_name, national_id, employer, monthly_income, consent, created_at, updated_at FROM profiles WHERE user_id = ?",
-            (user_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "user_id": row[0],
-            "full_name": row[1],
-            "national_id": row[2],
-            "employer": row[3],
-            "monthly_income": row[4],
-            "consent": row[5],
-            "created_at": row[6],
-            "updated_at": row[7],
-        }
+    row = _conn().execute(_Q_GET_PROFILE, (user_id,)).fetchone()
+    if not row:
+        return None
+    return {
+        "user_id": row[0],
+        "full_name": row[1],
+        "national_id": row[2],
+        "employer": row[3],
+        "monthly_income": row[4],
+        "consent": row[5],
+        "created_at": row[6],
+        "updated_at": row[7],
+    }
+
+
+def get_user_with_profile(chat_id: str) -> Optional[dict]:
+    """Return the user and their profile fields in one query, or None if unregistered.
+
+    Profile keys are None when the user has not onboarded yet.
+    """
+    row = _conn().execute(_Q_GET_USER_WITH_PROFILE, (chat_id,)).fetchone()
+    if not row:
+        return None
+    return {
+        "id": row[0],
+        "chat_id": row[1],
+        "phone": row[2],
+        "full_name": row[3],
+        "national_id": row[4],
+        "employer": row[5],
+        "monthly_income": row[6],
+        "consent": row[7],
+    }
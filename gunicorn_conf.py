@@ -0,0 +1,22 @@
+"""Gunicorn settings for the webhook apps.
+
+    gunicorn -c gunicorn_conf.py app:app
+
+The app is imported once in the master (preload) so the FAQ index, Redis
+pool and SQLite schema setup are shared copy-on-write by every worker.
+Each worker serves requests from a small thread pool; the handlers mostly
+wait on Redis/SQLite, so threads keep concurrent webhooks from queueing.
+
+Workers default to 2 rather than a CPU-count formula: cpu_count() sees the
+host, not the container's limit. Raise WEB_CONCURRENCY with care, since
+zac_bot._sessions lives in each worker process; multi-step flows (PIN,
+onboarding, loan application) need sticky routing per chat or a shared
+session store once there is more than one worker.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
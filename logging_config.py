@@ -2,14 +2,27 @@
 logging_config.py
 
 Configure a simple TimedRotatingFileHandler for local audit logs.
+
+Records are handed to the console/file handlers through a QueueHandler, so
+the thread that logs only does a queue put; formatting, writes and daily
+rollover happen on a background QueueListener thread.
 """
 
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
 
+_queue_handler = None
+_handlers = ()
+_listener = None
+
 
 def configure_logging(log_dir: str = None, level=logging.INFO):
+    global _queue_handler, _handlers, _listener
+
     log_dir = Path(log_dir or Path(__file__).parent / "logs")
     log_dir.mkdir(parents=True, exist_ok=True)
     log_file = log_dir / "chat_agents.log"
@@ -25,14 +38,43 @@ def configure_logging(log_dir: str = None, level=logging.INFO):
     # Console handler
     ch = logging.StreamHandler()
     ch.setFormatter(fmt)
-    root.addHandler(ch)
 
     # Rotating log file per day, keep 14 days
     fh = TimedRotatingFileHandler(
         str(log_file), when="midnight", interval=1, backupCount=14, utc=True
     )
     fh.setFormatter(fmt)
-    root.addHandler(fh)
+
+    _handlers = (ch, fh)
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+    root.addHandler(_queue_handler)
+    _start_listener()
+    atexit.register(_stop_listener)
+
+
+def _start_listener():
+    global _listener
+    _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _stop_listener():
+    # flushes queued records
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_after_fork():
+    # the listener thread does not survive fork (e.g. gunicorn --preload)
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.SimpleQueue()
+    _start_listener()
+
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
 
 
 __all__ = ["configure_logging"]
@@ -12,25 +12,190 @@ Job format (dict):
   {
     'platform': 'telegram' | 'whatsapp',
     'to': chat_id (int) for telegram or 'whatsapp:+123' for whatsapp,
-    'text': 'user message'
+    'text': 'user message',
+    'body': 'reply to send as-is (optional; skips answering `text`)',
+    'from': 'sender number for whatsapp (optional; defaults to TWILIO_WHATSAPP_NUMBER)'
   }
 
 This is a lightweight example for small deployments. For production use, replace with Redis/RQ or Celery.
 """
 
+import itertools
 import os
+import random
 import threading
+import time
 import logging
-import uuid
-from queue import Queue, Empty
-from typing import Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# imported up front so sends don't pay for it; without twilio installed,
+# WhatsApp replies are only logged
+try:
+    from twilio.base.exceptions import TwilioRestException
+    from twilio.http.http_client import TwilioHttpClient as _TwilioHttpClient
+    from twilio.rest import Client as _TwilioClient
+except ImportError:
+    _TwilioHttpClient = _TwilioClient = None
+
+    class TwilioRestException(Exception):
+        status = msg = None
+
+try:
+    from .ai_core import Answerer
+except ImportError:
+    from ai_core import Answerer
 
 logger = logging.getLogger(__name__)
 
-_queue = Queue()
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# One deque per worker: enqueue_message round-robins jobs across them, each
+# worker drains its own deque FIFO and, when it runs dry, steals half of a
+# random victim's backlog. Deque 0 exists before start_workers() runs so jobs
+# can be queued early. Each deque is guarded by its own Condition, which idle
+# workers sleep on until a job or stop_workers() wakes them.
+_deques: List[deque] = [deque()]
+_conds: List[threading.Condition] = [threading.Condition()]
+_rr = itertools.count()
+# job ids: "<pid hex>-<counter hex>"; unique per process, sortable by enqueue order
+_id_prefix = f"{os.getpid():x}-"
+_id_counter = itertools.count(1)
+_pending = 0  # queued or in-flight jobs, for position/ETA
+_pending_lock = threading.Lock()
+_start_lock = threading.Lock()
+_stop_event = threading.Event()
 _workers_started = False
+_workers_pid = None
 _num_workers = 0
-_avg_process_time = 2.5  # seconds, rough average per job for ETA calculation
+# seconds per job for the ETA, an EMA updated by the workers; written
+# without a lock since a slightly stale float is fine
+_avg_process_time = 2.5
+_ema_alpha = 0.2
+
+# a worker takes up to MAX_BATCH queued jobs at once (see _process_batch)
+MAX_BATCH = int(os.getenv("MQ_MAX_BATCH", 16))
+# per-message body limits: Telegram sendMessage 4096, Twilio WhatsApp 1600
+_MAX_MESSAGE_CHARS = {"telegram": 4096, "whatsapp": 1600}
+_DEFAULT_MAX_CHARS = 1600
+# MQ_COALESCE_MS > 0 holds replies per destination until no new one has
+# arrived for that long (at most 4 windows), so a burst to one chat goes out
+# as one message; 0 (the default) sends as soon as a batch is answered
+_COALESCE_S = int(os.getenv("MQ_COALESCE_MS", 0)) / 1000
+_held: Dict[tuple, tuple] = {}  # destination -> (first held at, replies)
+_held_timers: Dict[tuple, threading.Timer] = {}
+_held_lock = threading.Lock()
+# MQ_PIN_THREADS=1 pins worker i to the i-th allowed CPU (Linux only)
+_PIN_THREADS = bool(os.getenv("MQ_PIN_THREADS"))
+
+# send credentials, read once instead of per reply; _reload_config() picks
+# up changes (worker.py calls it on SIGHUP)
+_cfg: Dict[str, Optional[str]] = {}
+
+
+def _reload_config():
+    _cfg.update(
+        tg_token=os.getenv("TELEGRAM_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN"),
+        tw_sid=os.getenv("TWILIO_ACCOUNT_SID"),
+        tw_token=os.getenv("TWILIO_AUTH_TOKEN"),
+        tw_from=os.getenv("TWILIO_WHATSAPP_NUMBER"),
+    )
+
+
+_reload_config()
+# rate-limited (HTTP 429) destinations back off this long at most; their
+# unsent bodies, and anything sent to them meanwhile, wait in _backoff and go
+# out in order from a timer thread
+_MAX_RETRY_AFTER = 30
+_backoff: Dict[tuple, List[str]] = {}  # destination -> bodies still to send
+_backoff_lock = threading.Lock()
+_send_pool = None
+_send_pool_lock = threading.Lock()
+
+
+def _get_send_pool() -> ThreadPoolExecutor:
+    global _send_pool
+    with _send_pool_lock:
+        if _send_pool is None:
+            _send_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mq-send")
+        return _send_pool
+
+
+def _new_telegram_session() -> requests.Session:
+    # keep-alive pool shared by all workers; only connect failures are
+    # retried (POST is not idempotent, so read errors are not)
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=Retry(total=2, backoff_factor=0.2)),
+    )
+    return session
+
+
+_tg_session = _new_telegram_session()
+
+
+@lru_cache(maxsize=16)
+def _telegram_url(token: str, method: str) -> str:
+    return f"{TELEGRAM_API_URL}/bot{token}/{method}"
+
+
+def _telegram_post(method: str, payload: Dict) -> requests.Response:
+    """Call a Bot API method as a JSON POST on the shared session.
+
+    Raises requests.HTTPError for non-2xx responses.
+    """
+    resp = _tg_session.post(_telegram_url(_cfg["tg_token"], method), json=payload, timeout=5)
+    resp.raise_for_status()
+    return resp
+
+
+# one Twilio Client per (sid, token), all on one TwilioHttpClient (and so
+# one requests.Session)
+_twilio_http = None
+_twilio_client = None
+_twilio_key = None
+_client_lock = threading.Lock()
+
+
+def get_twilio_client(sid: str, token: str):
+    """Return the process's shared Twilio Client for (sid, token).
+
+    Returns None when the twilio package isn't installed. otp sends OTPs
+    through the same client, so the process holds a single HTTPS pool.
+    """
+    global _twilio_http, _twilio_client, _twilio_key
+    if _TwilioClient is None:
+        return None
+    client = _twilio_client
+    if client is not None and _twilio_key == (sid, token):
+        return client
+    with _client_lock:
+        if _twilio_client is None or _twilio_key != (sid, token):
+            if _twilio_http is None:
+                _twilio_http = _TwilioHttpClient(pool_connections=True, timeout=10)
+            _twilio_client = _TwilioClient(sid, token, http_client=_twilio_http)
+            _twilio_key = (sid, token)
+        return _twilio_client
+
+
+_answerer = None
+_answerer_lock = threading.Lock()
+
+
+def _get_answerer() -> Answerer:
+    global _answerer
+    if _answerer is None:
+        with _answerer_lock:
+            if _answerer is None:
+                _answerer = Answerer()
+    return _answerer
 
 
 def enqueue_message(job: Dict):
@@ -38,75 +203,237 @@ def enqueue_message(job: Dict):
 
     Returns: {'job_id': str, 'position': int, 'eta_seconds': int}
     """
-    job_id = str(uuid.uuid4())
+    if _workers_started and _workers_pid != os.getpid():
+        # forked (e.g. gunicorn --preload) after start_workers ran
+        start_workers(_num_workers)
+    global _pending
+    job_id = f"{_id_prefix}{next(_id_counter):x}"
     job_with_id = dict(job)
     job_with_id["job_id"] = job_id
-    _queue.put(job_with_id)
-    position = _queue.qsize()
+    idx = next(_rr) % len(_deques)
+    with _pending_lock:
+        _pending += 1
+        position = _pending
+    cond = _conds[idx]
+    with cond:
+        _deques[idx].append(job_with_id)
+        backlog = len(_deques[idx]) > 1
+        cond.notify()
+    if backlog and len(_conds) > 1:
+        # the owner is behind; nudge a neighbour so it can steal
+        neighbour = _conds[(idx + 1) % len(_conds)]
+        with neighbour:
+            neighbour.notify()
     workers = max(1, _num_workers)
     eta = int((position / workers) * _avg_process_time)
     return {"job_id": job_id, "position": position, "eta_seconds": eta}
 
 
-def _process_job(job: Dict):
+def _reply_for(job: Dict) -> str:
+    # If a raw body is provided, send it directly. Otherwise, generate answer via Answerer.
+    if "body" in job:
+        return job.get("body")
+    resp = _get_answerer().answer(job.get("text", ""))
+    return resp.get("answer")
+
+
+def _telegram_retry_after(resp) -> float:
     try:
-        # If a raw body is provided, send it directly. Otherwise, generate answer via Answerer.
-        if "body" in job:
-            reply = job.get("body")
+        return float(resp.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return float(resp.headers.get("Retry-After", 1))
+
+
+def _retry_later(key: tuple, bodies: List[str], delay: float):
+    """Park a destination's unsent bodies after a 429 and retry them on a timer."""
+    with _backoff_lock:
+        waiting = _backoff.get(key)
+        if waiting is not None:
+            # already backing off: these go ahead of whatever queued since
+            waiting[:0] = bodies
+            return
+        _backoff[key] = list(bodies)
+    _schedule_retry(key, delay)
+
+
+def _schedule_retry(key: tuple, delay: float):
+    delay = min(max(delay, 0), _MAX_RETRY_AFTER)
+    logger.warning("%s rate limited sending to %s; retrying in %.1fs", key[0], key[1], delay)
+    timer = threading.Timer(delay, _flush_backoff, args=(key,))
+    timer.daemon = True
+    timer.start()
+
+
+def _flush_backoff(key: tuple):
+    platform, to, from_number = key
+    while True:
+        with _backoff_lock:
+            waiting = _backoff[key]
+            if not waiting:
+                del _backoff[key]
+                return
+            body = waiting.pop(0)
+        try:
+            delay = _send(platform, to, body, from_number)
+        except Exception:
+            logger.exception("Error processing job")
+            continue
+        if delay is not None:
+            with _backoff_lock:
+                waiting.insert(0, body)
+            _schedule_retry(key, delay)
+            return
+
+
+def _send(platform, to, reply, from_number=None) -> Optional[float]:
+    """Send one message; returns the back-off in seconds if rate limited, else None."""
+    if platform == "telegram":
+        if _cfg["tg_token"] and to is not None:
+            try:
+                _telegram_post("sendMessage", {"chat_id": to, "text": reply})
+                logger.info("Sent Telegram reply to %s", to)
+            except requests.HTTPError as exc:
+                if exc.response is not None and exc.response.status_code == 429:
+                    return _telegram_retry_after(exc.response)
+                else:
+                    logger.warning("Failed sending telegram reply to %s: %s", to, exc)
+            except requests.RequestException as exc:
+                logger.warning("Failed sending telegram reply to %s: %s", to, exc)
         else:
+            logger.info(
+                "Telegram not configured or chat_id missing; reply: %s", reply
+            )
+
+    elif platform == "whatsapp":
+        sid = _cfg["tw_sid"]
+        token = _cfg["tw_token"]
+        from_number = from_number or _cfg["tw_from"]
+        if _TwilioClient is not None and sid and token and from_number and to:
             try:
-                from .ai_core import Answerer
-            except ImportError:
-                from ai_core import Answerer
-
-            answerer = Answerer()
-            resp = answerer.answer(job.get("text", ""))
-            reply = resp.get("answer")
-
-        platform = job.get("platform")
-        to = job.get("to")
-
-        if platform == "telegram":
-            token = os.getenv("TELEGRAM_TOKEN")
-            if token and to is not None:
-                try:
-                    from telegram import Bot
-
-                    bot = Bot(token=token)
-                    bot.send_message(chat_id=to, text=reply)
-                    logger.info("Sent Telegram reply to %s", to)
-                except Exception:
-                    logger.exception("Failed sending telegram reply")
-            else:
-                logger.info(
-                    "Telegram not configured or chat_id missing; reply: %s", reply
-                )
-
-        elif platform == "whatsapp":
-            sid = os.getenv("TWILIO_ACCOUNT_SID")
-            token = os.getenv("TWILIO_AUTH_TOKEN")
-            from_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
-            if sid and token and from_number and to:
-                try:
-                    from twilio.rest import Client
-
-                    client = Client(sid, token)
-                    client.messages.create(body=reply, from_=from_number, to=to)
-                    logger.info("Sent WhatsApp reply to %s", to)
-                except Exception:
-                    logger.exception("Failed sending whatsapp reply")
-            else:
-                logger.info(
-                    "Twilio not configured or destination missing; reply: %s", reply
-                )
-
+                client = get_twilio_client(sid, token)
+                client.messages.create(body=reply, from_=from_number, to=to)
+                logger.info("Sent WhatsApp reply to %s", to)
+            except TwilioRestException as exc:
+                if exc.status == 429:
+                    return 1.0
+                else:
+                    logger.warning("Failed sending whatsapp reply to %s: %s", to, exc.msg)
+            except requests.RequestException as exc:
+                logger.warning("Failed sending whatsapp reply to %s: %s", to, exc)
         else:
-            logger.warning("Unknown platform for job: %s", job)
+            logger.info(
+                "Twilio not configured or destination missing; reply: %s", reply
+            )
 
+    else:
+        logger.warning("Unknown platform %r for reply to %s", platform, to)
+    return None
+
+
+def _pack(replies: List[str], limit: int) -> List[str]:
+    """Join replies with newlines into as few messages of <= limit chars as possible."""
+    bodies = []
+    for reply in replies:
+        if bodies and len(bodies[-1]) + 1 + len(reply) <= limit:
+            bodies[-1] = f"{bodies[-1]}\n{reply}"
+        else:
+            bodies.append(reply)
+    return bodies
+
+
+def _send_all(platform, to, from_number, bodies):
+    # one destination's messages go out in order, including across a 429
+    # back-off: the rest of the bodies wait with the one that was refused
+    key = (platform, to, from_number)
+    with _backoff_lock:
+        waiting = _backoff.get(key)
+        if waiting is not None:
+            waiting.extend(bodies)
+            return
+    for n, body in enumerate(bodies):
+        delay = _send(platform, to, body, from_number)
+        if delay is not None:
+            _retry_later(key, bodies[n:], delay)
+            return
+
+
+def _hold(key: tuple, replies: List[str]):
+    """Add replies to key's coalescing window and restart its timer."""
+    now = time.monotonic()
+    with _held_lock:
+        since, held = _held.get(key, (now, []))
+        held.extend(replies)
+        _held[key] = (since, held)
+        timer = _held_timers.get(key)
+        if timer is not None:
+            timer.cancel()
+        delay = max(0.0, min(_COALESCE_S, since + 4 * _COALESCE_S - now))
+        timer = threading.Timer(delay, _flush_held, args=(key,))
+        timer.daemon = True
+        _held_timers[key] = timer
+        timer.start()
+
+
+def _flush_held(key: tuple):
+    with _held_lock:
+        if _held_timers.get(key) is not threading.current_thread():
+            return  # superseded by a newer timer after cancel() came too late
+        del _held_timers[key]
+        _, replies = _held.pop(key)
+    platform, to, from_number = key
+    try:
+        _send_all(platform, to, from_number, _pack(replies, _MAX_MESSAGE_CHARS.get(platform, _DEFAULT_MAX_CHARS)))
     except Exception:
         logger.exception("Error processing job")
 
 
+def _process_batch(batch: List[Dict]):
+    """Answer a batch of jobs, merge replies per destination and send them.
+
+    Replies to the same chat are joined into as few messages as the platform
+    allows; different chats are sent concurrently on the shared send pool.
+    With MQ_COALESCE_MS set, replies are handed to the coalescing window
+    instead and sent when it closes.
+    """
+    groups: Dict[tuple, List[str]] = {}
+    for job in batch:
+        try:
+            reply = _reply_for(job)
+        except Exception:
+            logger.exception("Error processing job")
+            continue
+        if reply is None:
+            logger.warning("Dropping job %s: no reply to send", job.get("job_id"))
+            continue
+        key = (job.get("platform"), job.get("to"), job.get("from"))
+        groups.setdefault(key, []).append(reply)
+
+    if _COALESCE_S > 0:
+        for key, replies in groups.items():
+            _hold(key, replies)
+        return
+    sends = [
+        (platform, to, from_number, _pack(replies, _MAX_MESSAGE_CHARS.get(platform, _DEFAULT_MAX_CHARS)))
+        for (platform, to, from_number), replies in groups.items()
+    ]
+    if len(sends) == 1:
+        try:
+            _send_all(*sends[0])
+        except Exception:
+            logger.exception("Error processing job")
+        return
+    futures = [_get_send_pool().submit(_send_all, *args) for args in sends]
+    for future in as_completed(futures):
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Error processing job")
+
+
+def _process_job(job: Dict):
+    _process_batch([job])
+
+
 def enqueue_raw_message(platform: str, to: str, body: str):
     """Convenience to enqueue a raw message body to a platform (whatsapp/sms/telegram)."""
     job = {"platform": platform, "to": to, "body": body}
@@ -133,32 +460,153 @@ def enqueue_otp_for_user(chat_id: str):
     return enqueue_raw_message("whatsapp", u.get("phone"), body)
 
 
-def _worker_loop(stop_event: threading.Event):
-    logger.info("Worker started")
-    while not stop_event.is_set():
-        try:
-            job = _queue.get(timeout=1.0)
-        except Empty:
+def _steal(i: int) -> Optional[Dict]:
+    """Move half of another worker's backlog (newest end) onto deque i."""
+    n = len(_deques)
+    start = random.randrange(n)
+    for k in range(n):
+        j = (start + k) % n
+        if j == i:
             continue
+        with _conds[j]:
+            victim = _deques[j]
+            if not victim:
+                continue
+            stolen = [victim.pop() for _ in range((len(victim) + 1) // 2)]
+        stolen.reverse()
+        job = stolen.pop(0)
+        if stolen:
+            with _conds[i]:
+                _deques[i].extend(stolen)
+        return job
+    return None
+
+
+def _next_job(i: int) -> Optional[Dict]:
+    with _conds[i]:
+        if _deques[i]:
+            return _deques[i].popleft()
+    return _steal(i)
+
+
+def _next_batch(i: int) -> List[Dict]:
+    """Next job for worker i plus whatever else is waiting on its deque, up to MAX_BATCH."""
+    job = _next_job(i)
+    if job is None:
+        return []
+    batch = [job]
+    own = _deques[i]
+    with _conds[i]:
+        while own and len(batch) < MAX_BATCH:
+            batch.append(own.popleft())
+    return batch
+
+
+def _pin_to_cpu(i: int):
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[i % len(cpus)]})
+    except (AttributeError, OSError) as exc:
+        logger.warning("Could not pin worker %d: %s", i, exc)
+
+
+def _worker_loop(i: int, stop_event: threading.Event):
+    global _pending, _avg_process_time
+    if _PIN_THREADS:
+        _pin_to_cpu(i)
+    logger.info("Worker %d started", i)
+    own, cond = _deques[i], _conds[i]
+    # bound once; these run on every pass through the loop
+    stopped, next_batch, process, clock = stop_event.is_set, _next_batch, _process_batch, time.perf_counter
+    pending_lock = _pending_lock
+    while not stopped():
+        batch = next_batch(i)
+        if not batch:
+            # re-check under the lock so a job pushed after _next_job() isn't missed
+            with cond:
+                if not own and not stopped():
+                    cond.wait()
+            continue
+        t0 = clock()
         try:
-            _process_job(job)
+            process(batch)
+        except Exception:
+            # a bad batch must not take the worker down with it
+            logger.exception("Error processing batch")
         finally:
-            _queue.task_done()
-    logger.info("Worker stopped")
+            with pending_lock:
+                _pending -= len(batch)
+        per_job = (clock() - t0) / len(batch)
+        _avg_process_time = (1 - _ema_alpha) * _avg_process_time + _ema_alpha * per_job
+    logger.info("Worker %d stopped", i)
+
+
+def _reset_after_fork():
+    # worker threads don't survive fork, locks copied mid-use may be held,
+    # and pooled sockets can't be shared with the parent; the child gets
+    # fresh ones and restarts workers lazily
+    global _deques, _conds, _pending, _pending_lock, _start_lock, _stop_event
+    global _id_prefix, _id_counter
+    global _tg_session, _twilio_http, _twilio_client, _twilio_key, _client_lock
+    global _send_pool, _send_pool_lock, _held, _held_timers, _held_lock
+    global _backoff, _backoff_lock
+    _deques = [deque()]
+    _conds = [threading.Condition()]
+    _id_prefix = f"{os.getpid():x}-"
+    _id_counter = itertools.count(1)
+    _pending = 0
+    _pending_lock = threading.Lock()
+    _start_lock = threading.Lock()
+    _stop_event = threading.Event()
+    _tg_session = _new_telegram_session()
+    _twilio_http = None
+    _twilio_client = None
+    _twilio_key = None
+    _client_lock = threading.Lock()
+    _send_pool = None
+    _send_pool_lock = threading.Lock()
+    _held = {}
+    _held_timers = {}
+    _held_lock = threading.Lock()
+    _backoff = {}
+    _backoff_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 def start_workers(num_workers: int = 1):
+    """Start background worker threads once per process."""
     global _workers_started
+    global _workers_pid
     global _num_workers
-    if _workers_started:
-        return
-    _workers_started = True
-    _num_workers = max(1, int(num_workers))
-    stop_event = threading.Event()
-    for i in range(_num_workers):
-        t = threading.Thread(target=_worker_loop, args=(stop_event,), daemon=True)
-        t.start()
+    global _stop_event
+    with _start_lock:
+        if _workers_started and _workers_pid == os.getpid():
+            return
+        _workers_started = True
+        _workers_pid = os.getpid()
+        _num_workers = max(1, int(num_workers))
+        # grow in place: deque 0 may already hold early jobs
+        for _ in range(len(_deques), _num_workers):
+            _conds.append(threading.Condition())
+            _deques.append(deque())
+        _stop_event = threading.Event()
+        for i in range(_num_workers):
+            t = threading.Thread(target=_worker_loop, args=(i, _stop_event), name=f"mq-worker-{i}", daemon=True)
+            t.start()
     logger.info("Started %d background worker(s)", _num_workers)
 
 
-__all__ = ["enqueue_message", "start_workers"]
+def stop_workers():
+    """Wake every worker and let it exit after its current job."""
+    global _workers_started
+    with _start_lock:
+        _workers_started = False
+        _stop_event.set()
+        for cond in _conds:
+            with cond:
+                cond.notify_all()
+
+
+__all__ = ["enqueue_message", "get_twilio_client", "start_workers", "stop_workers"]
@@ -2,36 +2,57 @@
 import os
 import hmac
 import hashlib
-import random
-from datetime import datetime, timedelta
-from typing import Tuple
+import secrets
+import time
+from typing import Dict, Iterable, Optional, Tuple
 
 try:
-    from .db import create_otp_for_user, consume_otp
+    from .db import create_otp_for_user, create_otps_bulk, consume_otp
+    from .message_queue import get_twilio_client
 except ImportError:
-    from db import create_otp_for_user, consume_otp
+    from db import create_otp_for_user, create_otps_bulk, consume_otp
+    from message_queue import get_twilio_client
 
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 TWILIO_WHATSAPP_NUMBER = os.environ.get("TWILIO_WHATSAPP_NUMBER")
 
+# keyed once at import; copying skips re-deriving the inner/outer pads per code
+_OTP_SECRET = os.environ.get("OTP_SECRET", "otp-secret").encode("utf-8")
+_HMAC_PROTOTYPE = hmac.new(_OTP_SECRET, digestmod=hashlib.sha256)
+
 
 def _hash_code(code: str) -> str:
-    # simple HMAC-ish hash for storage; use server-side secret if available
-    secret = os.environ.get("OTP_SECRET", "otp-secret")
-    return hmac.new(secret.encode("utf-8"), code.encode("utf-8"), hashlib.sha256).hexdigest()
+    # HMAC-SHA256 of the code with the server-side secret, for storage
+    h = _HMAC_PROTOTYPE.copy()
+    h.update(code.encode("utf-8"))
+    return h.hexdigest()
 
 
 def generate_code() -> str:
-    return f"{random.randint(0, 999999):06d}"
+    return f"{secrets.randbelow(1_000_000):06d}"
+
+
+def store_otp(chat_id: str, code: str, lifetime_seconds: int = 300) -> Optional[int]:
+    """Store an already generated code; returns the row id, or None for an unknown user."""
+    expires_at = int(time.time()) + int(lifetime_seconds)
+    return create_otp_for_user(chat_id, _hash_code(code), expires_at)
 
 
 def create_and_store_otp(chat_id: str, lifetime_seconds: int = 300) -> Tuple[str, int]:
     code = generate_code()
-    code_hash = _hash_code(code)
-    expires_at = (datetime.utcnow() + timedelta(seconds=lifetime_seconds)).isoformat()
-    rowid = create_otp_for_user(chat_id, code_hash, expires_at)
-    return code, rowid
+    return code, store_otp(chat_id, code, lifetime_seconds)
+
+
+def create_and_store_otps(chat_ids: Iterable[str], lifetime_seconds: int = 300) -> Dict[str, str]:
+    """Like `create_and_store_otp` for many users at once; returns {chat_id: code}.
+
+    Codes are returned for every chat_id given, but only stored for known users.
+    """
+    expires_at = int(time.time()) + int(lifetime_seconds)
+    codes = {str(chat_id): generate_code() for chat_id in chat_ids}
+    create_otps_bulk((chat_id, _hash_code(code), expires_at) for chat_id, code in codes.items())
+    return codes
 
 
 def verify_otp(chat_id: str, code: str) -> bool:
@@ -43,9 +64,10 @@ def send_via_twilio(to_number: str, body: str) -> bool:
     if not (TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN):
         return False
     try:
-        from twilio.rest import Client
-
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        # the client message_queue sends WhatsApp replies with
+        client = get_twilio_client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        if client is None:
+            return False
         # If sending WhatsApp, ensure to_number is in "whatsapp:+<number>" format and use TWILIO_WHATSAPP_NUMBER
         if to_number.startswith("whatsapp:") and TWILIO_WHATSAPP_NUMBER:
             from_num = f"whatsapp:{TWILIO_WHATSAPP_NUMBER}"
@@ -2,13 +2,24 @@
 
 Minimal Telegram polling bot that avoids third-party Telegram libraries so it
 can run quickly. Uses the local `ai_core.AnswerEngine` to generate replies.
+
+One coroutine long-polls getUpdates and hands messages to a few reply
+coroutines, each with its own asyncio.Queue, so answering and sending overlap
+with the next poll. A chat always maps to the same replier, which keeps its
+replies in order. The blocking HTTP and answer calls run via asyncio.to_thread.
 """
 
+import asyncio
 import os
-import time
 import json
-import urllib.parse
-import urllib.request
+from urllib.parse import urlencode
+
+import urllib3
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 try:
     from .ai_core import AnswerEngine
 except ImportError:
@@ -21,58 +32,90 @@ if not TOKEN:
 
 BASE = f"https://api.telegram.org/bot{TOKEN}"
 
+REPLY_WORKERS = 8
+
+# only text messages are handled, so have Telegram drop everything else
+_ALLOWED_UPDATES = json.dumps(["message"])
+
+# one keep-alive pool for the long-poll and the replies
+_http = urllib3.PoolManager(
+    num_pools=2, maxsize=REPLY_WORKERS + 1, retries=urllib3.Retry(total=3, backoff_factor=0.1)
+)
+
 
 def get_updates(offset=None, timeout=20):
-    url = f"{BASE}/getUpdates?timeout={timeout}"
-    if offset:
-        url += f"&offset={offset}"
-    with urllib.request.urlopen(url, timeout=timeout + 5) as r:
-        data = json.load(r)
-    return data
+    query = urlencode({"timeout": timeout, "offset": offset or 0, "allowed_updates": _ALLOWED_UPDATES})
+    r = _http.request("GET", f"{BASE}/getUpdates?{query}", timeout=timeout + 5)
+    return _loads(r.data)
 
 
 def send_message(chat_id, text):
-    data = urllib.parse.urlencode({"chat_id": chat_id, "text": text}).encode()
-    req = urllib.request.Request(f"{BASE}/sendMessage", data=data)
-    with urllib.request.urlopen(req, timeout=10) as r:
-        return json.load(r)
+    r = _http.request(
+        "POST",
+        f"{BASE}/sendMessage",
+        fields={"chat_id": chat_id, "text": text},
+        encode_multipart=False,
+        timeout=10,
+    )
+    return _loads(r.data)
 
 
-def main():
-    engine = AnswerEngine()  # uses faq.yml and optional LLM if configured
+async def _poller(queues):
     offset = None
-    print("Starting quick polling bot. Press CTRL+C to stop.")
     while True:
         try:
-            res = get_updates(offset=offset)
-            if not res.get("ok"):
-                time.sleep(1)
-                continue
-            for upd in res.get("result", []):
-                offset = upd["update_id"] + 1
-                if "message" not in upd:
-                    continue
-                msg = upd["message"]
-                chat = msg.get("chat", {})
-                chat_id = chat.get("id")
-                text = msg.get("text", "").strip()
-                if not text:
-                    continue
-                print(f"Received from {chat_id}: {text}")
-                mem = []
-                reply = engine.answer(text, memory=mem)
-                if isinstance(reply, dict):
-                    reply_text = reply.get("answer")
-                else:
-                    reply_text = str(reply)
-                send_message(chat_id, reply_text)
-                print(f"Replied to {chat_id}")
-        except KeyboardInterrupt:
-            print("Stopping polling bot.")
-            break
+            res = await asyncio.to_thread(get_updates, offset=offset)
         except Exception as e:
             print("Error in poll loop:", e)
-            time.sleep(2)
+            await asyncio.sleep(2)
+            continue
+        if not res.get("ok"):
+            await asyncio.sleep(1)
+            continue
+        for upd in res.get("result", []):
+            offset = upd["update_id"] + 1
+            if "message" not in upd:
+                continue
+            msg = upd["message"]
+            chat = msg.get("chat", {})
+            chat_id = chat.get("id")
+            text = msg.get("text", "").strip()
+            if not text:
+                continue
+            print(f"Received from {chat_id}: {text}")
+            await queues[hash(chat_id) % REPLY_WORKERS].put((chat_id, text))
+
+
+async def _replier(engine, queue):
+    while True:
+        chat_id, text = await queue.get()
+        try:
+            mem = []
+            reply = await asyncio.to_thread(engine.answer, text, memory=mem)
+            if isinstance(reply, dict):
+                reply_text = reply.get("answer")
+            else:
+                reply_text = str(reply)
+            await asyncio.to_thread(send_message, chat_id, reply_text)
+            print(f"Replied to {chat_id}")
+        except Exception as e:
+            print("Error replying:", e)
+        finally:
+            queue.task_done()
+
+
+async def _run():
+    engine = AnswerEngine()  # uses faq.yml and optional LLM if configured
+    queues = [asyncio.Queue(maxsize=32) for _ in range(REPLY_WORKERS)]
+    print("Starting quick polling bot. Press CTRL+C to stop.")
+    await asyncio.gather(_poller(queues), *(_replier(engine, q) for q in queues))
+
+
+def main():
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        print("Stopping polling bot.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,33 @@
+"""
+routing.py
+
+Text normalization shared by the WhatsApp webhooks: maps plain-word
+commands ("balance", "apply loan", "verify otp 123456") onto the slash
+commands understood by zac_bot.handle_command.
+"""
+
+_WA_ALIASES = {
+    "register": "/register",
+    "onboard": "/onboard",
+    "profile": "/profile",
+    "balance": "/balance",
+    "loans": "/loans",
+    "apply loan": "/apply_loan",
+    "loan": "/apply_loan",
+    "send otp": "/send_otp",
+}
+_VERIFY_PREFIX = "verify otp"
+
+
+def normalize_wa(body: str) -> str:
+    """Return the slash-command form of a WhatsApp message, or body unchanged."""
+    if body.startswith("/"):
+        return body
+    lowered = body.lower()
+    normalized = _WA_ALIASES.get(lowered)
+    if normalized is not None:
+        return normalized
+    if lowered.startswith(_VERIFY_PREFIX):
+        code = lowered[len(_VERIFY_PREFIX):].strip()
+        return f"/verify_otp {code}" if code else "/verify_otp"
+    return body
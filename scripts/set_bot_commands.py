@@ -7,9 +7,13 @@ Usage:
 import os
 import sys
 import json
-import urllib.request
 import argparse
 
+import urllib3
+
+# the script makes several calls in a row; reuse one connection
+_http = urllib3.PoolManager(num_pools=1, maxsize=1, retries=urllib3.Retry(total=3, backoff_factor=0.1))
+
 
 def call(method, data=None):
     token = os.environ.get("TELEGRAM_TOKEN")
@@ -19,13 +23,11 @@ def call(method, data=None):
     url = f"https://api.telegram.org/bot{token}/{method}"
     headers = {"Content-Type": "application/json"}
     if data is None:
-        with urllib.request.urlopen(url, timeout=10) as r:
-            return json.load(r)
+        r = _http.request("GET", url, timeout=10)
     else:
         b = json.dumps(data).encode()
-        req = urllib.request.Request(url, data=b, headers=headers)
-        with urllib.request.urlopen(req, timeout=10) as r:
-            return json.load(r)
+        r = _http.request("POST", url, body=b, headers=headers, timeout=10)
+    return json.loads(r.data)
 
 
 def main():
@@ -1,3 +1,5 @@
+import pytest
+
 from chat_agents.ai_core import Answerer
 
 
@@ -19,3 +21,41 @@ def test_answerer_fallback(tmp_path):
     a = Answerer(kb_path=str(kb), threshold=0.9)
     res = a.answer("Unrelated query that should not match")
     assert "couldn" in res["answer"] or res["index"] is None
+
+
+def test_answerer_top_k_orders_by_score(tmp_path):
+    kb = tmp_path / "kb.txt"
+    kb.write_text(
+        "How do I set up Twilio?\nFollow the Twilio docs.\n\n"
+        "How do I set up Telegram?\nTalk to BotFather.\n\n"
+        "What are your opening hours?\nWe open at 8am."
+    )
+    a = Answerer(kb_path=str(kb))
+    res = a.top_k("set up Twilio", k=2)
+    assert [r["index"] for r in res][0] == 0
+    assert len(res) == 2
+    assert res[0]["score"] >= res[1]["score"]
+    assert a.top_k("set up Twilio", k=10)[-1]["index"] == 2
+
+
+def test_answerer_scores_match_tfidf_vectorizer(tmp_path):
+    sklearn_text = pytest.importorskip("sklearn.feature_extraction.text")
+    np = pytest.importorskip("numpy")
+    kb = tmp_path / "kb.txt"
+    kb.write_text(
+        "How do I apply for a loan?\nUse /apply.\n\n"
+        "What is my loan balance?\nUse /loans.\n\n"
+        "How do I reset my PIN?\nUse /reset_pin."
+    )
+    a = Answerer(kb_path=str(kb))
+    ref = sklearn_text.TfidfVectorizer().fit(a.questions)
+    ref_matrix = ref.transform(a.questions)
+    for q in (
+        "how do i apply for a loan please thanks kindly",
+        "loan balance",
+        "reset pin zzzz qqq",
+        "nothing known here",
+    ):
+        expected = (ref_matrix @ ref.transform([q]).T).toarray().ravel()
+        got = a._score(*a._vectorize_query(q))
+        np.testing.assert_allclose(got, expected, atol=1e-5)
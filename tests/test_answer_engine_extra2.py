@@ -6,3 +6,42 @@ def test_answer_engine_returns_str_and_handles_memory():
     # returns a string reply for a simple query
     reply = ae.answer("hello there", memory=[{"role": "user", "text": "hi"}])
     assert isinstance(reply, str)
+
+
+def test_answer_engine_caches_normalized_replies(tmp_path):
+    kb = tmp_path / "kb.txt"
+    kb.write_text("How do I set up Twilio?\nFollow the Twilio docs.")
+    ae = AnswerEngine(kb_path=str(kb))
+    first = ae.answer("How do I set up Twilio?")
+    again = ae.answer("  how do i set up twilio?  ")
+    spaced = ae.answer("How  do I\tset up Twilio?")
+    assert first == again == spaced
+    assert ae._reply_cache.cache_info().hits == 2
+
+    kb.write_text("How do I set up Twilio?\nUse the Twilio console.")
+    ae.reload()
+    assert ae.answer("How do I set up Twilio?") == "Use the Twilio console."
+
+
+def test_answer_engine_skips_llm_below_floor(tmp_path):
+    kb = tmp_path / "kb.txt"
+    kb.write_text("How do I set up Twilio?\nFollow the Twilio docs.")
+    ae = AnswerEngine(kb_path=str(kb))
+    ae.use_llm = True
+    calls = []
+    ae._call_llm = lambda prompt: calls.append(prompt) or "llm reply"
+
+    # no term overlap at all -> score 0.0, below llm_floor
+    assert ae.answer("qwerty zxcvb") != "llm reply"
+    assert calls == []
+
+    ae.llm_floor = 0.0
+    assert ae.answer("qwerty zxcvb") == "llm reply"
+    assert len(calls) == 1
+
+
+def test_answer_engine_uses_llm_without_faq(tmp_path):
+    ae = AnswerEngine(kb_path=str(tmp_path / "missing.txt"))
+    ae.use_llm = True
+    ae._call_llm = lambda prompt: "llm reply"
+    assert ae.answer("qwerty zxcvb") == "llm reply"
@@ -0,0 +1,40 @@
+import asyncio
+import binascii
+import hashlib
+import os
+
+from chat_agents import auth
+
+
+def test_pin_hash_roundtrip():
+    salt, h = auth.make_pin_hash("1234")
+    assert auth.verify_pin("1234", salt, h) is True
+    assert auth.verify_pin("4321", salt, h) is False
+
+
+def test_pbkdf2_sha512_hash_verifies_without_argon2(monkeypatch):
+    monkeypatch.setattr(auth, "_ARGON2", None)
+    salt, h = auth.make_pin_hash("1234")
+    assert h.startswith("sha512$")
+    assert auth.verify_pin("1234", salt, h) is True
+    assert auth.verify_pin("4321", salt, h) is False
+
+
+def test_legacy_sha256_hash_still_verifies():
+    salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", b"1234", salt, 100_000)
+    salt_hex = binascii.hexlify(salt).decode("ascii")
+    hash_hex = binascii.hexlify(dk).decode("ascii")
+    assert auth.verify_pin("1234", salt_hex, hash_hex) is True
+    assert auth.verify_pin("0000", salt_hex, hash_hex) is False
+
+
+def test_async_helpers_use_process_pool():
+    async def roundtrip():
+        salt, h = await auth.make_pin_hash_async("1234")
+        return (
+            await auth.verify_pin_async("1234", salt, h),
+            await auth.verify_pin_async("4321", salt, h),
+        )
+
+    assert asyncio.run(roundtrip()) == (True, False)
@@ -1,6 +1,9 @@
 import os
 import tempfile
 import importlib
+import sqlite3
+
+import pytest
 from chat_agents import db, auth
 
 
@@ -34,3 +37,156 @@ def test_balance_and_loans(tmp_path):
     loans = db.list_loans("c1_loans")
     assert len(loans) == 1
     assert loans[0]["amount"] == 5000
+
+
+def test_connection_reused_in_wal_mode(tmp_path):
+    dbfile = tmp_path / "zac_test3.db"
+    os.environ["ZAC_DB_PATH"] = str(dbfile)
+    importlib.reload(db)
+    db.init_db()
+    c = db._conn()
+    assert db._conn() is c
+    assert c.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    names = {r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_loans_user", "idx_otps_user_code"} <= names
+
+
+def test_unknown_chat_lookups(tmp_path):
+    dbfile = tmp_path / "zac_test4.db"
+    os.environ["ZAC_DB_PATH"] = str(dbfile)
+    importlib.reload(db)
+    db.init_db()
+    assert db.get_balance("nobody") is None
+    assert db.create_loan("nobody", 100, "x") is None
+    assert db.list_loans("nobody") == []
+    assert db.create_otp_for_user("nobody", "h", 32503680000) is None
+    assert db.consume_otp("nobody", "h") is False
+
+
+def test_user_lookup_sees_writes_from_other_connections(tmp_path):
+    dbfile = tmp_path / "zac_test5.db"
+    os.environ["ZAC_DB_PATH"] = str(dbfile)
+    importlib.reload(db)
+    db.init_db()
+    assert db.get_user_by_chat("fresh") is None
+    db.create_user(chat_id="fresh", phone=None, pin_salt="", pin_hash="")
+    assert db.get_user_by_chat("fresh")["phone"] is None
+    # another worker process updating the row must be visible straight away
+    other = sqlite3.connect(str(dbfile))
+    other.execute("UPDATE users SET phone = ? WHERE chat_id = ?", ("+1", "fresh"))
+    other.commit()
+    other.close()
+    assert db.get_user_by_chat("fresh")["phone"] == "+1"
+
+
+def test_init_db_converts_iso_timestamps(tmp_path):
+    dbfile = tmp_path / "zac_test6.db"
+    os.environ["ZAC_DB_PATH"] = str(dbfile)
+    importlib.reload(db)
+    # tables as created before timestamps became integers
+    db._conn().execute(
+        "CREATE TABLE otps (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, code_hash TEXT,"
+        " expires_at TEXT, consumed INTEGER DEFAULT 0, created_at TEXT)"
+    )
+    db._conn().execute(
+        "CREATE TABLE loans (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, amount REAL,"
+        " reason TEXT, status TEXT, created_at TEXT)"
+    )
+    db.init_db()
+    uid = db.create_user(chat_id="legacy", phone=None, pin_salt="", pin_hash="")
+    db._conn().execute(
+        "INSERT INTO otps (user_id, code_hash, expires_at, consumed, created_at) VALUES (?, ?, ?, 0, ?)",
+        (uid, "h", "2000-01-01T00:00:00.123456", "2000-01-01T00:00:00"),
+    )
+    db._conn().execute(
+        "INSERT INTO loans (user_id, amount, reason, status, created_at) VALUES (?, 1, 'r', 'pending', ?)",
+        (uid, "2000-01-01T00:00:00"),
+    )
+    db.init_db()
+    db.init_db()
+    assert db.consume_otp("legacy", "h") is False
+    db.create_otp_for_user("legacy", "h2", 32503680000)
+    assert db.consume_otp("legacy", "h2") is True
+    db.create_loan("legacy", 2, "r")
+    assert [l["created_at"] > 946684800 for l in db.list_loans("legacy")] == [True, False]
+    assert db.list_loans("legacy")[1]["created_at"] == 946684800
+
+
+def test_get_user_with_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_uwp.db"))
+    db.init_db()
+    assert db.get_user_with_profile("nobody") is None
+
+    uid = db.create_user(chat_id="uwp", phone=None, pin_salt="", pin_hash="")
+    row = db.get_user_with_profile("uwp")
+    assert row["id"] == uid and row["consent"] is None
+
+    db.upsert_profile(uid, "Jane Doe", "12345678", "Acme", 50000, 1)
+    row = db.get_user_with_profile("uwp")
+    assert (row["full_name"], row["monthly_income"], row["consent"]) == ("Jane Doe", 50000, 1)
+
+
+def test_update_user_phone(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_phone.db"))
+    db.init_db()
+    uid = db.create_user(chat_id="ph", phone=None, pin_salt="", pin_hash="")
+    assert db.get_user_by_chat("ph")["phone"] is None
+
+    assert db.update_user_phone(uid, "whatsapp:+254700000000") is True
+    assert db.get_user_by_chat("ph")["phone"] == "whatsapp:+254700000000"
+    assert db.update_user_phone(uid + 100, "x") is False
+
+
+def test_connection_pragmas(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_pragma.db"))
+    c = db._conn()
+    assert c.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert c.execute("PRAGMA busy_timeout").fetchone()[0] == 30000
+    assert c.execute("PRAGMA cache_size").fetchone()[0] == -64000
+
+
+def test_submit_loan_returns_income(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_submit.db"))
+    db.init_db()
+    assert db.submit_loan("nobody", 100, "x") == (None, None)
+    uid = db.create_user(chat_id="sl", phone=None, pin_salt="", pin_hash="")
+    loan_id, income = db.submit_loan("sl", 100, "x")
+    assert isinstance(loan_id, int) and income is None
+    db.upsert_profile(uid, "Jane Doe", "12345678", "Acme", 40000, 1)
+    assert db.submit_loan("sl", 200, "y")[1] == 40000
+
+
+def test_list_loans_formatted_matches_rows(tmp_path, monkeypatch):
+    import time
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_fmt.db"))
+    db.init_db()
+    db.create_user(chat_id="lf", phone=None, pin_salt="", pin_hash="")
+    db.create_loan("lf", 5000, "stock")
+    db.create_loan("lf", 750.5, "fees")
+    expected = [
+        f"#{l['id']}: KES {l['amount']} - {l['status']} ({time.strftime('%Y-%m-%d %H:%M', time.gmtime(l['created_at']))})"
+        for l in db.list_loans("lf")
+    ]
+    assert db.list_loans_formatted("lf") == expected
+    assert db.list_loans_formatted("nobody") == []
+
+
+def test_write_rolls_back_failed_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_commit.db"))
+    c = db._conn()
+    # a deferred foreign key is only checked at COMMIT, so COMMIT itself fails
+    c.execute("PRAGMA foreign_keys=ON")
+    c.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+    c.execute(
+        "CREATE TABLE child (pid INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)"
+    )
+    with pytest.raises(sqlite3.IntegrityError):
+        with db._write() as cur:
+            cur.execute("INSERT INTO child (pid) VALUES (1)")
+    assert not c.in_transaction
+    # the thread's connection is still usable for the next write
+    with db._write() as cur:
+        cur.execute("INSERT INTO parent (id) VALUES (1)")
+    assert c.execute("SELECT COUNT(*) FROM child").fetchone()[0] == 0
+    c.execute("PRAGMA foreign_keys=OFF")
@@ -7,3 +7,111 @@ def test_enqueue_message_basic():
     assert isinstance(status, dict)
     assert "job_id" in status
     assert "eta_seconds" in status
+
+
+def test_idle_worker_steals_half_of_backlog(monkeypatch):
+    from collections import deque
+    import threading
+    from chat_agents import message_queue
+
+    own, victim = deque(), deque(["a", "b", "c", "d"])
+    monkeypatch.setattr(message_queue, "_deques", [own, victim])
+    monkeypatch.setattr(message_queue, "_conds", [threading.Condition(), threading.Condition()])
+
+    assert message_queue._next_job(0) == "c"
+    assert list(own) == ["d"]
+    assert list(victim) == ["a", "b"]
+    # the owner keeps draining its own deque oldest-first
+    assert message_queue._next_job(1) == "a"
+
+
+def test_stop_workers_wakes_idle_workers(monkeypatch):
+    from collections import deque
+    import threading
+    import time
+    from chat_agents import message_queue
+
+    monkeypatch.setattr(message_queue, "_deques", [deque()])
+    monkeypatch.setattr(message_queue, "_conds", [threading.Condition()])
+    monkeypatch.setattr(message_queue, "_workers_started", False)
+    monkeypatch.setattr(message_queue, "_workers_pid", None)
+    monkeypatch.setattr(message_queue, "_num_workers", 0)
+    monkeypatch.setattr(message_queue, "_stop_event", threading.Event())
+    before = threading.active_count()
+    message_queue.start_workers(2)
+    assert threading.active_count() == before + 2
+    names = {t.name for t in threading.enumerate()}
+    assert {"mq-worker-0", "mq-worker-1"} <= names
+
+    message_queue.stop_workers()
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() == before
+
+
+def test_batch_merges_replies_per_destination(monkeypatch):
+    from chat_agents import message_queue
+
+    sent = []
+    monkeypatch.setattr(message_queue, "_send", lambda platform, to, body, from_number=None: sent.append((to, body)))
+    message_queue._process_batch(
+        [
+            {"platform": "telegram", "to": 1, "body": "a"},
+            {"platform": "telegram", "to": 2, "body": "x"},
+            {"platform": "telegram", "to": 1, "body": "b"},
+        ]
+    )
+    assert sorted(sent) == [(1, "a\nb"), (2, "x")]
+
+
+def test_pack_respects_message_limit():
+    from chat_agents.message_queue import _pack
+
+    assert _pack(["aaa", "bbb", "cc"], 7) == ["aaa\nbbb", "cc"]
+
+
+def test_job_ids_are_unique_and_ordered():
+    import os
+
+    a = enqueue_message({"platform": "telegram", "to": 1, "body": "x"})["job_id"]
+    b = enqueue_message({"platform": "telegram", "to": 1, "body": "y"})["job_id"]
+    prefix = f"{os.getpid():x}-"
+    assert a.startswith(prefix) and b.startswith(prefix)
+    assert int(b[len(prefix):], 16) > int(a[len(prefix):], 16)
+
+
+def test_worker_tracks_average_process_time(monkeypatch):
+    from collections import deque
+    import threading
+    from chat_agents import message_queue
+
+    stop = threading.Event()
+    monkeypatch.setattr(message_queue, "_deques", [deque(["a", "b"])])
+    monkeypatch.setattr(message_queue, "_conds", [threading.Condition()])
+    monkeypatch.setattr(message_queue, "_pending", 2)
+    monkeypatch.setattr(message_queue, "_avg_process_time", 10.0)
+    monkeypatch.setattr(message_queue, "_process_batch", lambda batch: stop.set())
+
+    message_queue._worker_loop(0, stop)
+    # one near-instant batch pulls the estimate 20% of the way towards zero
+    assert 7.9 < message_queue._avg_process_time < 8.01
+
+
+def test_coalescing_window_merges_bursts(monkeypatch):
+    import time
+    from chat_agents import message_queue
+
+    sent = []
+    monkeypatch.setattr(message_queue, "_COALESCE_S", 0.05)
+    monkeypatch.setattr(message_queue, "_send", lambda platform, to, body, from_number=None: sent.append((to, body)))
+    message_queue._process_batch([{"platform": "telegram", "to": 1, "body": "a"}])
+    message_queue._process_batch([{"platform": "telegram", "to": 1, "body": "b"}])
+    assert sent == []
+
+    deadline = time.monotonic() + 2
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert sent == [(1, "a\nb")]
+    assert message_queue._held == {}
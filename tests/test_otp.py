@@ -49,3 +49,55 @@ def test_send_otp_cmd_variants(tmp_path, monkeypatch):
     resp2 = zac_bot.send_otp_cmd("u3")
     assert "OTP" in resp2
     assert isinstance(resp2, str) and len(resp2) > 0
+
+
+def test_hash_code_matches_plain_hmac():
+    import hashlib
+    import hmac
+
+    expected = hmac.new(otp._OTP_SECRET, b"123456", hashlib.sha256).hexdigest()
+    assert otp._hash_code("123456") == expected
+    # the prototype is copied, not consumed
+    assert otp._hash_code("123456") == expected
+
+
+def test_create_and_store_otps_bulk(tmp_path):
+    os.environ["ZAC_DB_PATH"] = str(tmp_path / "zac_otp_bulk.db")
+    db.init_db()
+    for cid in ("b1", "b2"):
+        db.create_user(chat_id=cid, phone="whatsapp:+1", pin_salt="", pin_hash="")
+
+    codes = otp.create_and_store_otps(["b1", "b2", "ghost"])
+    assert set(codes) == {"b1", "b2", "ghost"}
+    assert db.create_otps_bulk([("ghost", "h", 32503680000)]) == 0
+    assert otp.verify_otp("b1", codes["b1"]) is True
+    assert otp.verify_otp("b2", codes["b2"]) is True
+    assert otp.verify_otp("ghost", codes["ghost"]) is False
+
+
+def test_send_via_twilio_uses_shared_client(monkeypatch):
+    requested, sent = [], []
+
+    class FakeClient:
+        class messages:
+            @staticmethod
+            def create(**kwargs):
+                sent.append(kwargs)
+
+    def fake_get_client(sid, token):
+        requested.append((sid, token))
+        return FakeClient
+
+    monkeypatch.setattr(otp, "get_twilio_client", fake_get_client)
+    monkeypatch.setattr(otp, "TWILIO_ACCOUNT_SID", "AC123")
+    monkeypatch.setattr(otp, "TWILIO_AUTH_TOKEN", "token")
+    monkeypatch.setattr(otp, "TWILIO_WHATSAPP_NUMBER", "+15005550006")
+
+    assert otp.send_via_twilio("whatsapp:+100", "one") is True
+    assert otp.send_via_twilio("whatsapp:+100", "two") is True
+    assert requested == [("AC123", "token")] * 2
+    assert [m["body"] for m in sent] == ["one", "two"]
+    assert sent[0]["from_"] == "whatsapp:+15005550006"
+
+    monkeypatch.setattr(otp, "get_twilio_client", lambda sid, token: None)
+    assert otp.send_via_twilio("whatsapp:+100", "three") is False
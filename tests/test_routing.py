@@ -0,0 +1,15 @@
+from chat_agents.routing import normalize_wa
+
+
+def test_normalize_wa_aliases():
+    assert normalize_wa("Balance") == "/balance"
+    assert normalize_wa("apply loan") == "/apply_loan"
+    assert normalize_wa("LOAN") == "/apply_loan"
+    assert normalize_wa("send otp") == "/send_otp"
+    assert normalize_wa("verify otp 123456") == "/verify_otp 123456"
+    assert normalize_wa("verify otp") == "/verify_otp"
+
+
+def test_normalize_wa_passthrough():
+    assert normalize_wa("/Balance") == "/Balance"
+    assert normalize_wa("What are your hours?") == "What are your hours?"
@@ -20,6 +20,7 @@ def test_end_to_end_otp_flow(tmp_path, monkeypatch):
 
     # Import zac_bot after mocking to use the mocked otp
     from chat_agents import zac_bot
+    monkeypatch.setattr(zac_bot, "send_via_twilio", mock_send)
     code, _ = otp.create_and_store_otp("s_sys")
     resp = zac_bot.send_otp_cmd("s_sys")
 
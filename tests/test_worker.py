@@ -1,6 +1,4 @@
 import os
-import sys
-import types
 from chat_agents import db, message_queue
 
 
@@ -13,16 +11,18 @@ def test_enqueue_and_process_raw_message(tmp_path, monkeypatch):
     os.environ["TWILIO_ACCOUNT_SID"] = "AC123"
     os.environ["TWILIO_AUTH_TOKEN"] = "token"
     os.environ["TWILIO_WHATSAPP_NUMBER"] = "+15005550006"
+    message_queue._reload_config()
 
     # Create fake twilio.rest.Client
     recorded = []
-
-    rest_mod = types.ModuleType("twilio.rest")
+    clients = []
 
     class FakeClient:
-        def __init__(self, sid, token):
+        def __init__(self, sid, token, **kwargs):
             self.sid = sid
             self.token = token
+            self.http_client = kwargs.get("http_client")
+            clients.append(self)
 
             class Msg:
                 def create(self, **kwargs):
@@ -30,11 +30,9 @@ def test_enqueue_and_process_raw_message(tmp_path, monkeypatch):
 
             self.messages = Msg()
 
-    rest_mod.Client = FakeClient
-
-    # Inject fake modules
-    sys.modules["twilio"] = types.ModuleType("twilio")
-    sys.modules["twilio.rest"] = rest_mod
+    # Inject the fake client class and drop any cached client
+    monkeypatch.setattr(message_queue, "_TwilioClient", FakeClient)
+    monkeypatch.setattr(message_queue, "_twilio_client", None)
 
     # Directly call _process_job with a whatsapp job
     job = {"platform": "whatsapp", "to": "whatsapp:+100", "body": "hi otp"}
@@ -44,6 +42,24 @@ def test_enqueue_and_process_raw_message(tmp_path, monkeypatch):
     assert recorded[0]["body"] == "hi otp"
     assert recorded[0]["to"].startswith("whatsapp:")
 
+    # a second send reuses the client and its pooled HTTP client
+    message_queue._process_job(job)
+    assert len(recorded) == 2
+    assert len(clients) == 1
+    assert clients[0].http_client is not None
+    assert message_queue.get_twilio_client("AC123", "token") is clients[0]
+
+    # new credentials build a new client on the same HTTP pool
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "rotated")
+    message_queue._reload_config()
+    message_queue._process_job(job)
+    assert [c.token for c in clients] == ["token", "rotated"]
+    assert clients[1].http_client is clients[0].http_client
+
+    # without the twilio package there is no client to share
+    monkeypatch.setattr(message_queue, "_TwilioClient", None)
+    assert message_queue.get_twilio_client("AC123", "rotated") is None
+
 
 def test_enqueue_otp_for_user(tmp_path, monkeypatch):
     dbfile = tmp_path / "zac_worker2.db"
@@ -67,3 +83,146 @@ def test_enqueue_otp_for_user(tmp_path, monkeypatch):
     assert called["platform"] == "whatsapp"
     assert called["to"].startswith("whatsapp:")
     assert "OTP" in called["body"]
+
+
+def test_workers_restart_after_fork(monkeypatch):
+    # state as inherited by a gunicorn worker forked from a preloaded master
+    monkeypatch.setattr(message_queue, "_worker_loop", lambda i, stop_event: None)
+    monkeypatch.setattr(message_queue, "_workers_started", True)
+    monkeypatch.setattr(message_queue, "_workers_pid", -1)
+    monkeypatch.setattr(message_queue, "_num_workers", 1)
+
+    message_queue.enqueue_message({"platform": "telegram", "to": 1, "body": "x"})
+    assert message_queue._workers_pid == os.getpid()
+
+
+def test_telegram_reply_posts_on_shared_session(monkeypatch):
+    posted = []
+
+    class FakeResponse:
+        def raise_for_status(self):
+            pass
+
+    class FakeSession:
+        def post(self, url, json=None, timeout=None):
+            posted.append((url, json))
+            return FakeResponse()
+
+    monkeypatch.setitem(message_queue._cfg, "tg_token", "123:abc")
+    monkeypatch.setattr(message_queue, "_tg_session", FakeSession())
+
+    message_queue._process_job({"platform": "telegram", "to": 42, "body": "hello"})
+    assert posted == [
+        ("https://api.telegram.org/bot123:abc/sendMessage", {"chat_id": 42, "text": "hello"})
+    ]
+
+
+def test_reset_after_fork_drops_shared_clients(monkeypatch):
+    # the reset rebinds module globals; monkeypatch puts the live ones back
+    for name, value in list(vars(message_queue).items()):
+        if not name.startswith("__"):
+            monkeypatch.setattr(message_queue, name, value)
+    monkeypatch.setattr(message_queue, "_twilio_http", object())
+    monkeypatch.setattr(message_queue, "_twilio_client", object())
+    old_session = message_queue._tg_session
+    message_queue._reset_after_fork()
+    assert message_queue._twilio_http is None
+    assert message_queue._twilio_client is None
+    assert message_queue._tg_session is not old_session
+
+
+def test_telegram_429_backs_off_in_order(monkeypatch):
+    import requests
+
+    class FakeResponse:
+        status_code = 429
+        headers = {}
+
+        def json(self):
+            return {"ok": False, "error_code": 429, "parameters": {"retry_after": 3}}
+
+        def raise_for_status(self):
+            if limited:
+                limited.pop()
+                raise requests.HTTPError("429 Too Many Requests", response=self)
+
+    class FakeSession:
+        def post(self, url, json=None, timeout=None):
+            resp = FakeResponse()
+            resp.raise_for_status()
+            posted.append(json["text"])
+            return resp
+
+    timers = []
+
+    class FakeTimer:
+        def __init__(self, delay, fn, args=()):
+            timers.append((delay, fn, args))
+
+        def start(self):
+            pass
+
+    posted, limited = [], [True]
+    monkeypatch.setitem(message_queue._cfg, "tg_token", "123:abc")
+    monkeypatch.setattr(message_queue, "_tg_session", FakeSession())
+    monkeypatch.setattr(message_queue, "_backoff", {})
+    monkeypatch.setattr(message_queue.threading, "Timer", FakeTimer)
+
+    # the first body is refused: it and the rest wait, as does a later reply
+    message_queue._send_all("telegram", 42, None, ["one", "two"])
+    message_queue._send_all("telegram", 42, None, ["three"])
+    assert posted == []
+    assert [t[0] for t in timers] == [3.0]
+
+    delay, fn, args = timers[0]
+    fn(*args)
+    assert posted == ["one", "two", "three"]
+    assert message_queue._backoff == {}
+
+
+def test_worker_survives_bad_batch(monkeypatch):
+    import threading
+    import time
+
+    sent = []
+    monkeypatch.setattr(message_queue, "_deques", [message_queue.deque()])
+    monkeypatch.setattr(message_queue, "_conds", [threading.Condition()])
+    monkeypatch.setattr(message_queue, "_pending", 0)
+    monkeypatch.setattr(message_queue, "_COALESCE_S", 0)
+    monkeypatch.setattr(message_queue, "_send_all", lambda *args: sent.append(args))
+    real_process = message_queue._process_batch
+    calls = []
+
+    def process(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        real_process(batch)
+
+    monkeypatch.setattr(message_queue, "_process_batch", process)
+    stop = threading.Event()
+    worker = threading.Thread(target=message_queue._worker_loop, args=(0, stop), daemon=True)
+    worker.start()
+
+    def feed(*jobs):
+        with message_queue._conds[0]:
+            message_queue._deques[0].extend(jobs)
+            message_queue._conds[0].notify()
+
+    def wait_for(cond):
+        deadline = time.monotonic() + 5
+        while not cond() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    feed({"platform": "telegram", "to": 1, "body": "first"})
+    wait_for(lambda: calls)
+    # a job without a body used to crash _pack for the whole batch
+    feed({"platform": "telegram", "to": 2, "body": None}, {"platform": "telegram", "to": 2, "body": "ok"})
+    wait_for(lambda: sent)
+    assert worker.is_alive()
+    assert [s[3] for s in sent] == [["ok"]]
+
+    stop.set()
+    with message_queue._conds[0]:
+        message_queue._conds[0].notify_all()
+    worker.join(timeout=5)
@@ -0,0 +1,184 @@
+from chat_agents import zac_bot
+
+
+def test_fallback_reuses_one_answer_engine(monkeypatch):
+    built = []
+
+    class FakeEngine:
+        def __init__(self):
+            built.append(self)
+
+        def answer(self, text):
+            return f"echo: {text}"
+
+    monkeypatch.setattr(zac_bot, "AnswerEngine", FakeEngine)
+    monkeypatch.setattr(zac_bot, "_ANSWER_ENGINE", None)
+    assert zac_bot.handle_text("z1", "hello") == "echo: hello"
+    assert zac_bot.handle_text("z1", "again") == "echo: again"
+    assert len(built) == 1
+
+
+def test_handle_command_dispatch(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_cmd.db"))
+    monkeypatch.setattr(zac_bot, "_DB_READY", False)
+    assert zac_bot.handle_command("c1", "hello") is None
+    assert "/register" in zac_bot.handle_command("c1", "/help")
+    assert zac_bot.handle_command("c1", "/nope") == "Unknown command. Try /help."
+    assert zac_bot.handle_command("c1", "/onboard").startswith("You are not registered")
+    assert zac_bot.handle_command("c1", "/verify_otp") == "Usage: /verify_otp 123456"
+    assert "PIN" in zac_bot.handle_command("c1", "/register")
+    zac_bot._sessions.pop("c1", None)
+
+
+def test_apply_loan_requires_consented_profile(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_apply.db"))
+    monkeypatch.setattr(zac_bot, "_DB_READY", False)
+    assert zac_bot.handle_command("a1", "/apply_loan").startswith("You are not registered")
+    uid = db.create_user(chat_id="a1", phone=None, pin_salt="", pin_hash="")
+    assert zac_bot.handle_command("a1", "/apply_loan") == "Please complete onboarding first: /onboard."
+
+    db.upsert_profile(uid, "Jane Doe", "12345678", "Acme", 10000, 1)
+    assert zac_bot.handle_command("a1", "/apply_loan").startswith("How much")
+    assert zac_bot.handle_text("a1", "5000").startswith("Please briefly")
+    reply = zac_bot.handle_text("a1", "stock")
+    assert "pending approval" in reply and "KES 15,000" in reply
+
+
+def test_is_pin():
+    assert zac_bot._is_pin(" 1234 ") == "1234"
+    assert zac_bot._is_pin("123456") == "123456"
+    assert zac_bot._is_pin("123") is None
+    assert zac_bot._is_pin("1234567") is None
+    assert zac_bot._is_pin("12a4") is None
+
+
+def test_sessions_expire():
+    now = [0.0]
+    sessions = zac_bot._SessionCache(maxsize=2, ttl=60, timer=lambda: now[0])
+    sessions["a"] = {"state": "onboard_name"}
+    sessions["b"] = {}
+    sessions["c"] = {}
+    assert "a" not in sessions  # over maxsize
+    now[0] = 61
+    assert sessions.get("b") is None
+    assert sessions.pop("c", None) is None
+
+
+def test_parse_command():
+    assert zac_bot.parse_command("/Help") == ("help", None)
+    assert zac_bot.parse_command("/verify_otp  123456 ") == ("verify_otp", "123456")
+    assert zac_bot.parse_command("/verify_otp\n123456") == ("verify_otp", "123456")
+    assert zac_bot.parse_command("/verify_otp\t123456") == ("verify_otp", "123456")
+    assert zac_bot.parse_command("hello /help") == (None, None)
+    assert zac_bot.parse_command("") == (None, None)
+
+
+def test_profile_summary(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_summary.db"))
+    db.init_db()
+    uid = db.create_user(chat_id="ps", phone=None, pin_salt="", pin_hash="")
+    assert zac_bot.profile_summary("ps") == "No profile on file. Start with /onboard."
+    db.upsert_profile(uid, "Jane Doe", "12345678", "Acme", 55000, 1)
+    assert zac_bot.profile_summary("ps") == (
+        "Name: Jane Doe\nNational ID: 12345678\nEmployer: Acme\nMonthly income: KES 55,000\nConsent: yes"
+    )
+
+
+def test_get_loans_lists_each_loan(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_loans.db"))
+    db.init_db()
+    assert zac_bot.get_loans("gl") == "No loans found."
+    db.create_user(chat_id="gl", phone=None, pin_salt="", pin_hash="")
+    first = db.create_loan("gl", 5000, "stock")
+    second = db.create_loan("gl", 750.5, "fees")
+    lines = zac_bot.get_loans("gl").splitlines()
+    assert len(lines) == 2
+    assert {line.split(" (")[0] for line in lines} == {
+        f"#{first}: KES 5000.0 - pending",
+        f"#{second}: KES 750.5 - pending",
+    }
+
+
+def test_onboarding_flow(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_onboard.db"))
+    monkeypatch.setattr(zac_bot, "_DB_READY", False)
+    zac_bot.ensure_db()
+    uid = db.create_user(chat_id="ob", phone=None, pin_salt="", pin_hash="")
+
+    assert zac_bot.handle_command("ob", "/onboard").startswith("Welcome")
+    steps = [
+        ("Al", "Please enter your full name (at least 3 characters)."),
+        ("Jane Doe", "Thanks. Please enter your national ID number."),
+        ("1234", "Please enter a valid national ID number."),
+        ("12345678", "Who is your employer (or 'self-employed')?"),
+        ("Acme", "What is your estimated monthly income in KES?"),
+        ("lots", "Please enter a numeric income amount."),
+        ("-5", "Please enter a positive income amount."),
+        ("55,000", "Do you consent to storing this info for SACCO onboarding? Reply YES or NO."),
+        ("maybe", "Please reply YES or NO."),
+    ]
+    for text, reply in steps:
+        assert zac_bot.handle_text("ob", text) == reply
+    assert zac_bot.handle_text("ob", "yes").startswith("Onboarding complete")
+    prof = db.get_profile(uid)
+    assert (prof["full_name"], prof["employer"], prof["monthly_income"], prof["consent"]) == ("Jane Doe", "Acme", 55000, 1)
+    assert not zac_bot.has_active_session("ob")
+
+
+def test_phone_first_users_share_default_pin_hash(tmp_path, monkeypatch):
+    from chat_agents import auth, db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_phone_first.db"))
+    db.init_db()
+    zac_bot._default_pin_hash.cache_clear()
+    calls = []
+    real = zac_bot.make_pin_hash
+    monkeypatch.setattr(zac_bot, "make_pin_hash", lambda pin: calls.append(pin) or real(pin))
+
+    for cid in ("pf1", "pf2"):
+        assert zac_bot.handle_phone_submission(cid, "whatsapp:+254700000001").startswith("Phone saved")
+    assert calls == ["0000"]
+    u = db.get_user_by_chat("pf2")
+    assert auth.verify_pin("0000", u["pin_salt"], u["pin_hash"])
+    zac_bot._default_pin_hash.cache_clear()
+
+
+def test_send_otp_cmd_stores_code_it_returns(tmp_path, monkeypatch):
+    from chat_agents import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "zac_send_otp.db"))
+    db.init_db()
+    db.create_user(chat_id="so", phone="whatsapp:+254700000002", pin_salt="", pin_hash="")
+    monkeypatch.setattr(zac_bot, "send_via_twilio", lambda to, body: False)
+
+    reply = zac_bot.send_otp_cmd("so")
+    assert reply.startswith("OTP (dev): ")
+    code = reply.rsplit(" ", 1)[1]
+    assert zac_bot.verify_otp_cmd("so", code) == "OTP verified. You are authenticated."
+
+
+def test_send_otp_cmd_stores_before_sending(monkeypatch):
+    calls = []
+    monkeypatch.setattr(zac_bot, "get_user_by_chat", lambda c: {"phone": "whatsapp:+1"})
+    monkeypatch.setattr(
+        zac_bot, "create_and_store_otp", lambda c: calls.append("store") or ("123456", 1)
+    )
+    monkeypatch.setattr(zac_bot, "send_via_twilio", lambda to, body: calls.append("send") or True)
+    assert zac_bot.send_otp_cmd("x") == "OTP sent via configured Twilio channel."
+    assert calls == ["store", "send"]
+
+    # nothing goes out if the code couldn't be stored
+    calls.clear()
+    monkeypatch.setattr(zac_bot, "create_and_store_otp", lambda c: ("123456", None))
+    assert "try again" in zac_bot.send_otp_cmd("x")
+    assert calls == []
@@ -7,9 +7,9 @@ import sys
 import time
 
 try:
-    from .message_queue import start_workers
+    from .message_queue import _reload_config, start_workers
 except ImportError:
-    from message_queue import start_workers
+    from message_queue import _reload_config, start_workers
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +19,17 @@ def _shutdown(signum, frame):
     sys.exit(0)
 
 
+def _reload(signum, frame):
+    logger.info("Reloading send configuration")
+    _reload_config()
+
+
 def main():
     logging.basicConfig(level=logging.INFO)
     signal.signal(signal.SIGTERM, _shutdown)
     signal.signal(signal.SIGINT, _shutdown)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _reload)
 
     logger.info("Starting worker process")
     start_workers(1)
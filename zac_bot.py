@@ -4,6 +4,12 @@ This is intentionally simple and uses in-process session state for conversation
 """
 from typing import Dict, Optional, Tuple
 import logging
+import threading
+import time
+from functools import lru_cache
+from types import MappingProxyType
+
+from cachetools import TTLCache
 
 try:
     from .ai_core import AnswerEngine
@@ -12,12 +18,15 @@ try:
         get_user_by_chat,
         create_user,
         get_balance,
-        create_loan,
-        list_loans,
+        submit_loan,
+        list_loans_formatted,
         upsert_profile,
         get_profile,
+        get_user_with_profile,
+        update_user_phone,
     )
     from .auth import make_pin_hash, verify_pin
+    from .otp import create_and_store_otp, send_via_twilio, verify_otp
 except ImportError:
     from ai_core import AnswerEngine
     from db import (
@@ -25,21 +34,89 @@ except ImportError:
         get_user_by_chat,
         create_user,
         get_balance,
-        create_loan,
-        list_loans,
+        submit_loan,
+        list_loans_formatted,
         upsert_profile,
         get_profile,
+        get_user_with_profile,
+        update_user_phone,
     )
     from auth import make_pin_hash, verify_pin
+    from otp import create_and_store_otp, send_via_twilio, verify_otp
 
 logger = logging.getLogger(__name__)
 
-# in-memory sessions: chat_id -> session dict
-_sessions: Dict[str, Dict] = {}
+
+class _SessionCache(TTLCache):
+    """TTLCache with its item operations serialized; webhook threads share it."""
+
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        super().__init__(maxsize, ttl, timer)
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return super().__contains__(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return super().get(key, default)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return super().pop(key, default)
+
+
+# in-memory sessions: chat_id -> session dict; abandoned flows expire after
+# 30 minutes and the least recently set are dropped past 10k chats. Per
+# process: each Gunicorn worker has its own (see gunicorn_conf.py).
+_sessions: Dict[str, Dict] = _SessionCache(maxsize=10_000, ttl=1800)
+# shared read-only stand-in for "no session", so lookups don't allocate a {}
+_EMPTY = MappingProxyType({})
+
+_HELP_TEXT = (
+    "Zac SACCO assistant: /register, /onboard, /profile, /balance, "
+    "/apply_loan, /loans, /send_otp, /verify_otp <code>"
+)
+
+# built on the first fallback reply and shared after that
+_ANSWER_ENGINE: Optional[AnswerEngine] = None
+_AE_LOCK = threading.Lock()
+
+# init_db() runs once per process; later ensure_db() calls are no-ops
+_DB_READY = False
+_DB_LOCK = threading.Lock()
 
 
 def ensure_db():
-    init_db()
+    global _DB_READY
+    if not _DB_READY:
+        with _DB_LOCK:
+            if not _DB_READY:
+                init_db()
+                _DB_READY = True
+
+
+
+def _get_answer_engine() -> AnswerEngine:
+    global _ANSWER_ENGINE
+    if _ANSWER_ENGINE is None:
+        with _AE_LOCK:
+            if _ANSWER_ENGINE is None:
+                _ANSWER_ENGINE = AnswerEngine()
+    return _ANSWER_ENGINE
 
 
 def start_register(chat_id: str) -> str:
@@ -47,36 +124,43 @@ def start_register(chat_id: str) -> str:
     return "To register, reply with either a 4-6 digit PIN or send your phone number to enable OTP login."
 
 
+def _is_pin(text: str) -> Optional[str]:
+    """Return the stripped text if it is a 4-6 digit PIN, else None."""
+    s = text.strip()
+    return s if 4 <= len(s) <= 6 and s.isdigit() else None
+
+
 def handle_pin_submission(chat_id: str, text: str) -> str:
-    s = _sessions.get(chat_id, {})
-    if len(text.strip()) < 4 or len(text.strip()) > 6 or not text.strip().isdigit():
+    pin = _is_pin(text)
+    if pin is None:
         return "Please send a 4-6 digit numeric PIN."
-    salt, h = make_pin_hash(text.strip())
+    salt, h = make_pin_hash(pin)
     # create user
     create_user(chat_id=str(chat_id), phone=None, pin_salt=salt, pin_hash=h)
-    s.update({"state": "registered"})
+    s = _sessions.get(chat_id)
+    if s is not None:
+        s["state"] = "registered"
     return "Registration successful. You can now use /balance and /apply_loan."
 
 
+@lru_cache(maxsize=1)
+def _default_pin_hash() -> Tuple[str, str]:
+    # the placeholder PIN is public, so one KDF run can be shared by every
+    # phone-first user instead of paying for it on each submission
+    return make_pin_hash("0000")
+
+
 def handle_phone_submission(chat_id: str, text: str) -> str:
     # allow user to provide phone number; store it on user if exists
-    try:
-        from .db import _conn
-    except ImportError:
-        from db import _conn
-
     phone = text.strip()
     u = get_user_by_chat(str(chat_id))
     if not u:
         # create ephemeral user with phone - PIN still required for security
-        salt, h = make_pin_hash("0000")
+        salt, h = _default_pin_hash()
         user_id = create_user(chat_id=str(chat_id), phone=phone, pin_salt=salt, pin_hash=h)
         return "Phone saved. You can request an OTP with /send_otp. Please set a proper PIN later using /register."
     else:
-        with _conn() as c:
-            cur = c.cursor()
-            cur.execute("UPDATE users SET phone = ? WHERE id = ?", (phone, u["id"]))
-            c.commit()
+        update_user_phone(u["id"], phone)
         return "Phone updated. You can request an OTP with /send_otp."
 
 
@@ -89,51 +173,69 @@ def start_onboarding(chat_id: str) -> str:
     return "Welcome to Zac SACCO onboarding. What is your full name?"
 
 
-def _set_onboarding_value(chat_id: str, field: str, value: str):
-    s = _sessions.get(chat_id, {})
-    s[field] = value
-    _sessions[chat_id] = s
+def _parse_text(min_len: int, error: str):
+    def parse(text: str) -> str:
+        value = text.strip()
+        if len(value) < min_len:
+            raise ValueError(error)
+        return value
+
+    return parse
+
+
+def _parse_income(text: str) -> float:
+    try:
+        income = float(text.strip().replace(",", ""))
+    except ValueError:
+        raise ValueError("Please enter a numeric income amount.") from None
+    if income <= 0:
+        raise ValueError("Please enter a positive income amount.")
+    return income
+
+
+# state -> (session field, parser raising ValueError(reply), next state, next prompt)
+_ONBOARD_STEPS = {
+    "onboard_name": (
+        "full_name",
+        _parse_text(3, "Please enter your full name (at least 3 characters)."),
+        "onboard_national_id",
+        "Thanks. Please enter your national ID number.",
+    ),
+    "onboard_national_id": (
+        "national_id",
+        _parse_text(5, "Please enter a valid national ID number."),
+        "onboard_employer",
+        "Who is your employer (or 'self-employed')?",
+    ),
+    "onboard_employer": (
+        "employer",
+        _parse_text(2, "Please enter your employer name."),
+        "onboard_income",
+        "What is your estimated monthly income in KES?",
+    ),
+    "onboard_income": (
+        "monthly_income",
+        _parse_income,
+        "onboard_consent",
+        "Do you consent to storing this info for SACCO onboarding? Reply YES or NO.",
+    ),
+}
 
 
 def handle_onboarding(chat_id: str, text: str) -> str:
-    s = _sessions.get(chat_id, {})
+    s = _sessions.get(chat_id) or _EMPTY
     state = s.get("state")
 
-    if state == "onboard_name":
-        name = text.strip()
-        if len(name) < 3:
-            return "Please enter your full name (at least 3 characters)."
-        _set_onboarding_value(chat_id, "full_name", name)
-        s["state"] = "onboard_national_id"
-        return "Thanks. Please enter your national ID number."
-
-    if state == "onboard_national_id":
-        nid = text.strip()
-        if len(nid) < 5:
-            return "Please enter a valid national ID number."
-        _set_onboarding_value(chat_id, "national_id", nid)
-        s["state"] = "onboard_employer"
-        return "Who is your employer (or 'self-employed')?"
-
-    if state == "onboard_employer":
-        employer = text.strip()
-        if len(employer) < 2:
-            return "Please enter your employer name."
-        _set_onboarding_value(chat_id, "employer", employer)
-        s["state"] = "onboard_income"
-        return "What is your estimated monthly income in KES?"
-
-    if state == "onboard_income":
-        raw = text.strip().replace(",", "")
+    step = _ONBOARD_STEPS.get(state)
+    if step is not None:
+        field, parse, next_state, prompt = step
         try:
-            income = float(raw)
-            if income <= 0:
-                return "Please enter a positive income amount."
-        except Exception:
-            return "Please enter a numeric income amount."
-        _set_onboarding_value(chat_id, "monthly_income", income)
-        s["state"] = "onboard_consent"
-        return "Do you consent to storing this info for SACCO onboarding? Reply YES or NO."
+            s[field] = parse(text)
+        except ValueError as exc:
+            return str(exc)
+        s["state"] = next_state
+        _sessions[chat_id] = s
+        return prompt
 
     if state == "onboard_consent":
         consent = text.strip().lower()
@@ -182,51 +284,52 @@ def handle_loan_amount(chat_id: str, text: str) -> str:
 
 
 def handle_loan_reason(chat_id: str, text: str) -> str:
-    s = _sessions.get(chat_id, {})
+    s = _sessions.get(chat_id) or _EMPTY
     amt = s.get("amount")
     if amt is None:
         return "Loan amount missing; please start with /apply_loan."
-    loan_id = create_loan(str(chat_id), float(amt), text.strip())
+    loan_id, income = submit_loan(str(chat_id), float(amt), text.strip())
     _sessions.pop(chat_id, None)
     if loan_id:
-        profile = get_profile_by_chat(chat_id)
         limit_hint = ""
-        if profile and profile.get("monthly_income", 0) > 0:
-            limit = profile["monthly_income"] * 1.5
+        if income and income > 0:
+            limit = income * 1.5
             limit_hint = f" Based on your income, a typical pre-approval limit is ~KES {limit:,.0f}."
         return f"Loan request submitted (id: {loan_id}) and is pending approval.{limit_hint}"
     else:
         return "Could not create loan. Are you registered? Use /register to create an account."
 
 
-def handle_text(chat_id: str, text: str) -> str:
-    s = _sessions.get(chat_id, {})
-    state = s.get("state")
-    if state and state.startswith("onboard_"):
-        return handle_onboarding(chat_id, text)
-    if state == "awaiting_pin_or_phone":
-        # determine phone vs PIN
-        if text.strip().isdigit() and 4 <= len(text.strip()) <= 6:
-            return handle_pin_submission(chat_id, text)
-        return handle_phone_submission(chat_id, text)
-    if state == "awaiting_pin":
+def _route_pin_or_phone(chat_id: str, text: str) -> str:
+    if _is_pin(text) is not None:
         return handle_pin_submission(chat_id, text)
-    if state == "awaiting_loan_amount":
-        return handle_loan_amount(chat_id, text)
-    if state == "awaiting_loan_reason":
-        return handle_loan_reason(chat_id, text)
+    return handle_phone_submission(chat_id, text)
+
+
+# session state -> handler(chat_id, text); onboard_* states go to handle_onboarding
+_STATE_HANDLERS = {
+    "awaiting_pin_or_phone": _route_pin_or_phone,
+    "awaiting_pin": handle_pin_submission,
+    "awaiting_loan_amount": handle_loan_amount,
+    "awaiting_loan_reason": handle_loan_reason,
+}
+
+
+def handle_text(chat_id: str, text: str) -> str:
+    state = (_sessions.get(chat_id) or _EMPTY).get("state")
+    if state:
+        if state[:8] == "onboard_":
+            return handle_onboarding(chat_id, text)
+        handler = _STATE_HANDLERS.get(state)
+        if handler is not None:
+            return handler(chat_id, text)
     # default fallback
-    ae = AnswerEngine()
-    res = ae.answer(text)
+    res = _get_answer_engine().answer(text)
     return res if isinstance(res, str) else res.get("answer")
 
 
 def get_loans(chat_id: str) -> str:
-    loans = list_loans(str(chat_id))
-    if not loans:
-        return "No loans found."
-    lines = [f"#{l['id']}: KES {l['amount']} - {l['status']} ({l['created_at']})" for l in loans]
-    return "\n".join(lines)
+    return "\n".join(list_loans_formatted(str(chat_id))) or "No loans found."
 
 # OTP commands
 
@@ -234,27 +337,18 @@ def send_otp_cmd(chat_id: str) -> str:
     u = get_user_by_chat(str(chat_id))
     if not u or not u.get("phone"):
         return "No phone number on file; send your phone number first."
-    # create OTP and attempt to send via Twilio; if not configured, return code (for dev)
-    try:
-        from .otp import create_and_store_otp, send_via_twilio
-    except ImportError:
-        from otp import create_and_store_otp, send_via_twilio
-
-    code, _ = create_and_store_otp(str(chat_id))
-    # try to send via Twilio (WhatsApp if configured)
-    to = u.get("phone")
-    sent = send_via_twilio(to, f"Your Zac OTP: {code}")
+    # store the OTP before sending it, so a delivered code is always
+    # verifiable; if Twilio isn't configured, return the code (for dev)
+    code, otp_id = create_and_store_otp(str(chat_id))
+    if otp_id is None:
+        return "Couldn't create an OTP right now. Please try again."
+    sent = send_via_twilio(u.get("phone"), f"Your Zac OTP: {code}")
     if sent:
         return "OTP sent via configured Twilio channel."
     return f"OTP (dev): {code}"
 
 
 def verify_otp_cmd(chat_id: str, code: str) -> str:
-    try:
-        from .otp import verify_otp
-    except ImportError:
-        from otp import verify_otp
-
     ok = verify_otp(str(chat_id), code)
     if ok:
         return "OTP verified. You are authenticated."
@@ -272,13 +366,13 @@ def profile_summary(chat_id: str) -> str:
     profile = get_profile_by_chat(chat_id)
     if not profile:
         return "No profile on file. Start with /onboard."
-    consent = "yes" if profile.get("consent") else "no"
+    get = profile.get
+    name, nid, employer = get("full_name"), get("national_id"), get("employer")
+    income = get("monthly_income") or 0
+    consent = "yes" if get("consent") else "no"
     return (
-        f"Name: {profile.get('full_name')}\n"
-        f"National ID: {profile.get('national_id')}\n"
-        f"Employer: {profile.get('employer')}\n"
-        f"Monthly income: KES {profile.get('monthly_income', 0):,.0f}\n"
-        f"Consent: {consent}"
+        f"Name: {name}\nNational ID: {nid}\nEmployer: {employer}\n"
+        f"Monthly income: KES {income:,.0f}\nConsent: {consent}"
     )
 
 
@@ -287,14 +381,51 @@ def has_active_session(chat_id: str) -> bool:
 
 
 def parse_command(text: str) -> Tuple[Optional[str], Optional[str]]:
-    if not text:
-        return None, None
-    if not text.startswith("/"):
+    if not text or text[0] != "/":
         return None, None
-    parts = text.strip().split(maxsplit=1)
-    cmd = parts[0].lstrip("/").lower()
-    arg = parts[1] if len(parts) > 1 else None
-    return cmd, arg
+    parts = text.strip().split(None, 1)
+    return parts[0].lstrip("/").lower(), parts[1] if len(parts) > 1 else None
+
+
+def _cmd_help(chat_id: str, arg: Optional[str]) -> str:
+    return _HELP_TEXT
+
+
+def _cmd_onboard(chat_id: str, arg: Optional[str]) -> str:
+    if not require_registered(chat_id):
+        return "You are not registered. Use /register to create an account."
+    return start_onboarding(chat_id)
+
+
+def _cmd_apply_loan(chat_id: str, arg: Optional[str]) -> str:
+    # one query answers both "registered?" and "onboarded with consent?"
+    row = get_user_with_profile(str(chat_id))
+    if not row:
+        return "You are not registered. Use /register to create an account."
+    if not row["consent"]:
+        return "Please complete onboarding first: /onboard."
+    return start_apply_loan(chat_id)
+
+
+def _cmd_verify_otp(chat_id: str, arg: Optional[str]) -> str:
+    if not arg:
+        return "Usage: /verify_otp 123456"
+    return verify_otp_cmd(chat_id, arg.strip())
+
+
+# command name -> handler(chat_id, arg)
+_COMMANDS = {
+    "start": _cmd_help,
+    "help": _cmd_help,
+    "register": lambda chat_id, arg: start_register(chat_id),
+    "onboard": _cmd_onboard,
+    "profile": lambda chat_id, arg: profile_summary(chat_id),
+    "balance": lambda chat_id, arg: handle_balance(chat_id),
+    "apply_loan": _cmd_apply_loan,
+    "loans": lambda chat_id, arg: get_loans(chat_id),
+    "send_otp": lambda chat_id, arg: send_otp_cmd(chat_id),
+    "verify_otp": _cmd_verify_otp,
+}
 
 
 def handle_command(chat_id: str, text: str) -> Optional[str]:
@@ -302,35 +433,5 @@ def handle_command(chat_id: str, text: str) -> Optional[str]:
     cmd, arg = parse_command(text)
     if not cmd:
         return None
-    if cmd in ("start", "help"):
-        return (
-            "Zac SACCO assistant: /register, /onboard, /profile, /balance, "
-            "/apply_loan, /loans, /send_otp, /verify_otp <code>"
-        )
-    if cmd == "register":
-        ensure_db()
-        return start_register(chat_id)
-    if cmd == "onboard":
-        if not require_registered(chat_id):
-            return "You are not registered. Use /register to create an account."
-        return start_onboarding(chat_id)
-    if cmd == "profile":
-        return profile_summary(chat_id)
-    if cmd == "balance":
-        return handle_balance(chat_id)
-    if cmd == "apply_loan":
-        if not require_registered(chat_id):
-            return "You are not registered. Use /register to create an account."
-        profile = get_profile_by_chat(chat_id)
-        if not profile or not profile.get("consent"):
-            return "Please complete onboarding first: /onboard."
-        return start_apply_loan(chat_id)
-    if cmd == "loans":
-        return get_loans(chat_id)
-    if cmd == "send_otp":
-        return send_otp_cmd(chat_id)
-    if cmd == "verify_otp":
-        if not arg:
-            return "Usage: /verify_otp 123456"
-        return verify_otp_cmd(chat_id, arg.strip())
-    return "Unknown command. Try /help."
+    fn = _COMMANDS.get(cmd)
+    return fn(chat_id, arg) if fn else "Unknown command. Try /help."